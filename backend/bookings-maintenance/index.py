@@ -0,0 +1,83 @@
+'''
+Business: Обслуживание секций таблицы bookings: секции будущих месяцев и архивирование прошедших
+Args: event от триггера-таймера (без httpMethod) или HTTP-запрос с заголовком X-Maintenance-Token
+Returns: HTTP response со списком созданных и отсоединённых секций
+'''
+
+import hmac
+import json
+import os
+import time
+import psycopg2
+from typing import Dict, Any, Optional
+
+# Сколько месяцев вперёд держать готовые секции и сколько прошедших
+# месяцев оставлять в таблице до отсоединения в bookings_archive_ГГГГ_ММ
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', '12'))
+PARTITION_KEEP_MONTHS = int(os.environ.get('PARTITION_KEEP_MONTHS', '3'))
+
+def get_db_connection():
+    database_url = os.environ.get('DATABASE_URL')
+    return psycopg2.connect(database_url)
+
+def get_request_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    # Заголовки приходят в произвольном регистре
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+def token_matches(token: Optional[str], expected: Optional[str]) -> bool:
+    # Сравнение за постоянное время, чтобы токен нельзя было подобрать по задержке
+    if not expected or token is None:
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8'))
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    headers = {'Content-Type': 'application/json'}
+    
+    # Триггер-таймер вызывает функцию без httpMethod; HTTP-вызов
+    # допускается только с токеном из MAINTENANCE_TOKEN
+    if event.get('httpMethod'):
+        if not token_matches(get_request_header(event, 'X-Maintenance-Token'), os.environ.get('MAINTENANCE_TOKEN')):
+            return {
+                'statusCode': 403,
+                'headers': headers,
+                'body': json.dumps({'error': 'Доступ запрещён'}),
+                'isBase64Encoded': False
+            }
+    
+    started = time.perf_counter()
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT action, partition_name FROM bookings_maintain_partitions(%s, %s)",
+                (PARTITION_MONTHS_AHEAD, PARTITION_KEEP_MONTHS)
+            )
+            actions = [{'action': action, 'partition': name} for action, name in cur.fetchall()]
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    finally:
+        conn.close()
+    
+    print(json.dumps({
+        'event': 'partition_maintenance',
+        'actions': actions,
+        'total_ms': round((time.perf_counter() - started) * 1000, 2)
+    }))
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({'actions': actions}),
+        'isBase64Encoded': False
+    }
@@ -4,19 +4,1083 @@ Args: event с httpMethod, body, queryStringParameters
 Returns: HTTP response с данными записей или статусом операции
 '''
 
+import base64
+import binascii
+import gzip
+import hashlib
+import hmac
 import json
 import os
+import random
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from psycopg2 import extensions
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError
+from typing import Dict, Any, List, Optional, Tuple
 import secrets
-from datetime import datetime
+from datetime import datetime, date, timedelta
+
+try:
+    import brotli
+except ImportError:  # без пакета brotli ответы сжимаются только gzip
+    brotli = None
+
+# Настройки пула соединений (переживает тёплые вызовы контейнера)
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+DB_POOL_PING_INTERVAL = float(os.environ.get('DB_POOL_PING_INTERVAL', '30'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '5'))
+# Серверные подготовленные операторы; 0 — для PgBouncer в режиме transaction,
+# где следующий запрос может попасть на другое серверное соединение
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') == '1'
+# Для подготовленных операторов: общий план с отсечением секций при
+# выполнении вместо перепланирования под каждое значение даты
+DB_PLAN_CACHE_MODE = os.environ.get('DB_PLAN_CACHE_MODE', 'force_generic_plan')
+
+# Замеры фаз запроса: заголовок Server-Timing и строка лога на каждый запрос.
+# По умолчанию выключены, чтобы не писать лог на каждый запрос в бою;
+# REQUEST_TIMING=1 включает их на время разбора производительности.
+# SLOW_REQUEST_MS > 0 — помечать запросы медленнее порога как slow
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '0') == '1'
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '0'))
+
+# Сжатие ответов по Accept-Encoding: тела короче COMPRESS_MIN_BYTES
+# отдаются как есть — на них сжатие стоит дороже, чем экономит
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Постраничная выдача списка записей для админ-панели
+PAGE_DEFAULT_LIMIT = 100
+PAGE_MAX_LIMIT = 500
+PAGE_FETCH_CHUNK = 50
+PAGE_COLUMNS = (
+    'id', 'service', 'booking_date', 'booking_time', 'customer_name',
+    'customer_phone', 'status', 'created_at'
+)
+
+# Колонки записи в ответах API; хэш токена отмены наружу не отдаётся
+BOOKING_COLUMNS = (
+    'id', 'service', 'booking_date', 'booking_time', 'customer_name', 'customer_phone',
+    'status', 'duration_minutes', 'created_at', 'updated_at'
+)
+BOOKING_SELECT = ', '.join(BOOKING_COLUMNS)
+
+# Кэш занятых слотов по дате (живёт в тёплом контейнере)
+SLOTS_CACHE_MAX_SIZE = int(os.environ.get('SLOTS_CACHE_MAX_SIZE', '512'))
+SLOTS_CACHE_TTL = float(os.environ.get('SLOTS_CACHE_TTL', '60'))
+
+# Лента изменений bookings (LISTEN/NOTIFY, V0009): кэш слотов сбрасывается
+# по событиям от любого пишущего; при недоступной ленте остаётся только TTL.
+# Подписка занимает одно соединение пула на всё время жизни контейнера:
+# запросам остаётся DB_POOL_MAX_SIZE - 1, а БД видит на каждый тёплый
+# контейнер на одно постоянное соединение больше. CHANGE_FEED_ENABLED=0
+# возвращает соединение запросам, и кэш слотов живёт только по TTL/ETag
+CHANGE_FEED_ENABLED = os.environ.get('CHANGE_FEED_ENABLED', '1') == '1'
+CHANGE_FEED_CHANNEL = 'bookings_changes'
+CHANGE_FEED_RETRY_INTERVAL = float(os.environ.get('CHANGE_FEED_RETRY_INTERVAL', '30'))
+
+# Длительность сеанса по услуге (минуты), как в MASSAGE_SERVICES бота
+SERVICE_DURATIONS = {
+    'Классический массаж спина': 30,
+    'Успокаивающий массаж спина': 30,
+    'Классический массаж тело': 60,
+    'Расслабляющий массаж тела': 60,
+}
+DEFAULT_SERVICE_DURATION = 60
+BOOKING_TIME_RE = re.compile(r'^([01]?[0-9]|2[0-3]):[0-5][0-9]$')
+
+# Ключи идемпотентности POST: срок хранения и доля запросов, после которых
+# удаляется порция просроченных ключей
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+IDEMPOTENCY_CLEANUP_RATE = float(os.environ.get('IDEMPOTENCY_CLEANUP_RATE', '0.02'))
+IDEMPOTENCY_CLEANUP_BATCH = 500
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Максимум записей в одном пакетном POST
+BULK_MAX_ITEMS = 50
+
+# Токен админ-панели (заголовок X-Admin-Token) для пакетной отмены;
+# без переменной пакетная отмена недоступна
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# Максимальная длина диапазона для запроса свободных слотов (дней)
+AVAILABILITY_MAX_DAYS = 62
+
+# Максимальная длина диапазона для аналитики по сводке booking_stats (дней)
+STATS_MAX_DAYS = 366
+
+# Админ-список — предстоящие активные записи: условие по дате отсекает
+# секции прошедших месяцев (таблица секционирована по booking_date)
+ACTIVE_LIST_WHERE = "status = 'active' AND booking_date >= CURRENT_DATE"
+
+# Частые запросы обработчика: имя -> (типы параметров, SQL с $1..$n).
+# Готовятся PREPARE один раз на соединение пула (см. PreparedStatements)
+STATEMENTS: Dict[str, Tuple[str, str]] = {
+    # Ссылка отмены несёт дату записи: поиск по токену идёт в одной секции.
+    # Варианты без даты — для ссылок, выданных раньше; они проверяют все секции
+    'booking_by_token_and_date': (
+        'bytea, date',
+        f"SELECT {BOOKING_SELECT} FROM bookings WHERE cancel_token_hash = $1 AND booking_date = $2"
+    ),
+    'booking_by_token': (
+        'bytea',
+        f"SELECT {BOOKING_SELECT} FROM bookings WHERE cancel_token_hash = $1"
+    ),
+    'bookings_by_date': (
+        'date',
+        f"SELECT {BOOKING_SELECT} FROM bookings WHERE booking_date = $1 ORDER BY booking_time"
+    ),
+    'booked_times': (
+        'date[]',
+        "SELECT booking_date, booking_time FROM bookings "
+        "WHERE booking_date = ANY($1) AND status = 'active'"
+    ),
+    # Дешёвая версия набора строк для ETag: число строк и последний updated_at
+    'etag_by_date': (
+        'date',
+        "SELECT count(*), max(updated_at) FROM bookings WHERE booking_date = $1"
+    ),
+    'etag_active_list': (
+        '',
+        f"SELECT count(*), max(updated_at) FROM bookings WHERE {ACTIVE_LIST_WHERE}"
+    ),
+    # Занятость слота проверяет сама БД: уникальный индекс uq_bookings_active_slot
+    # и ограничение на пересечение интервалов сеансов в каждой секции.
+    # При конфликте строка не вставляется и RETURNING ничего не возвращает.
+    # Ключ идемпотентности ($8, может быть NULL) и хэш тела запроса ($9)
+    # сохраняются тем же запросом. Ключ, уже занятый живой записью (параллельный
+    # запрос с тем же ключом успел раньше), не перезаписывается: key_saved = false,
+    # и вызывающий откатывает вставку. Просроченный ключ ($10 — TTL в часах) занимается заново
+    'create_booking': (
+        'varchar, date, varchar, varchar, varchar, bytea, smallint, bytea, bytea, integer',
+        f"""WITH new_booking AS (
+            INSERT INTO bookings
+            (service, booking_date, booking_time, customer_name, customer_phone, cancel_token_hash, duration_minutes)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ON CONFLICT DO NOTHING
+            RETURNING {BOOKING_SELECT}
+        ), saved_key AS (
+            INSERT INTO booking_idempotency_keys (key_hash, booking_id, booking_date, request_hash)
+            SELECT $8, id, booking_date, $9 FROM new_booking WHERE $8 IS NOT NULL
+            ON CONFLICT (key_hash) DO UPDATE
+            SET booking_id = EXCLUDED.booking_id, booking_date = EXCLUDED.booking_date,
+                request_hash = EXCLUDED.request_hash, created_at = EXCLUDED.created_at
+            WHERE booking_idempotency_keys.created_at <= CURRENT_TIMESTAMP - make_interval(hours => $10)
+            RETURNING key_hash
+        )
+        SELECT new_booking.*, $8 IS NULL OR EXISTS (SELECT 1 FROM saved_key) AS key_saved
+        FROM new_booking"""
+    ),
+    # Один поиск по первичному ключу таблицы ключей; дата записи
+    # ограничивает поиск самой записи одной секцией
+    'idempotent_booking': (
+        'bytea, integer',
+        f"SELECT {', '.join('b.' + c for c in BOOKING_COLUMNS)}, k.request_hash "
+        "FROM booking_idempotency_keys k "
+        "JOIN bookings b ON b.id = k.booking_id AND b.booking_date = k.booking_date "
+        "WHERE k.key_hash = $1 AND k.created_at > CURRENT_TIMESTAMP - make_interval(hours => $2)"
+    ),
+    'cancel_by_token_and_date': (
+        'bytea, date',
+        "UPDATE bookings SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP "
+        f"WHERE cancel_token_hash = $1 AND booking_date = $2 RETURNING {BOOKING_SELECT}"
+    ),
+    'cancel_by_token': (
+        'bytea',
+        "UPDATE bookings SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP "
+        f"WHERE cancel_token_hash = $1 RETURNING {BOOKING_SELECT}"
+    ),
+    'cancel_by_id': (
+        'integer',
+        "UPDATE bookings SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP "
+        f"WHERE id = $1 RETURNING {BOOKING_SELECT}"
+    ),
+    'cancel_by_id_and_date': (
+        'integer, date',
+        "UPDATE bookings SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP "
+        f"WHERE id = $1 AND booking_date = $2 RETURNING {BOOKING_SELECT}"
+    ),
+    'cancel_by_ids': (
+        'integer[]',
+        "UPDATE bookings SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP "
+        f"WHERE id = ANY($1) AND status = 'active' RETURNING {BOOKING_SELECT}"
+    ),
+    'cancel_day': (
+        'date',
+        "UPDATE bookings SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP "
+        f"WHERE booking_date = $1 AND status = 'active' RETURNING {BOOKING_SELECT}"
+    ),
+    # Все разрезы аналитики одним запросом по сводке: GROUPING SETS даёт строки
+    # по дням, услугам, слотам дня недели и общий итог; grouping() отличает разрез
+    'booking_stats': (
+        'date, date',
+        """SELECT grouping(booking_date, service, weekday, booking_time) AS grp,
+                  booking_date, service, weekday, booking_time,
+                  coalesce(sum(booked), 0) AS booked, coalesce(sum(cancelled), 0) AS cancelled
+           FROM (
+               SELECT booking_date, service, booking_time, booked, cancelled,
+                      extract(isodow FROM booking_date)::int AS weekday
+               FROM booking_stats
+               WHERE booking_date BETWEEN $1 AND $2
+           ) s
+           GROUP BY GROUPING SETS ((booking_date), (service), (weekday, booking_time), ())
+           ORDER BY grp, booking_date, service, weekday, booking_time"""
+    ),
+}
 
 def get_db_connection():
     database_url = os.environ.get('DATABASE_URL')
-    return psycopg2.connect(database_url)
+    conn = psycopg2.connect(database_url)
+    if DB_PREPARED_STATEMENTS and DB_PLAN_CACHE_MODE:
+        # SET после COMMIT действует до конца сессии
+        with conn.cursor() as cur:
+            cur.execute('SET plan_cache_mode = %s', (DB_PLAN_CACHE_MODE,))
+        conn.commit()
+    return conn
+
+class RequestTimer:
+    '''
+    Накопитель длительностей фаз одного запроса: connect, query, fetch,
+    encode. Выключенный таймер ничего не замеряет — курсоры получают
+    timer=None, а dumps сразу вызывает json.dumps.
+    '''
+
+    def __init__(self, method: str, enabled: bool):
+        self.method = method
+        self.enabled = enabled
+        self.branch = 'none'
+        self.rows = 0
+        self.phases: Dict[str, float] = {}
+        self.started = time.perf_counter() if enabled else 0.0
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def dumps(self, obj: Any, **kwargs) -> str:
+        if not self.enabled:
+            return json.dumps(obj, **kwargs)
+        started = time.perf_counter()
+        result = json.dumps(obj, **kwargs)
+        self.add('encode', time.perf_counter() - started)
+        return result
+
+    def finish(self, response: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        total_ms = (time.perf_counter() - self.started) * 1000
+        timings = [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in self.phases.items()]
+        timings.append(f'total;dur={total_ms:.2f}')
+        response['headers']['Server-Timing'] = ', '.join(timings)
+        response['headers']['Timing-Allow-Origin'] = '*'
+        
+        slow = SLOW_REQUEST_MS > 0 and total_ms >= SLOW_REQUEST_MS
+        print(json.dumps({
+            'event': 'request',
+            'method': self.method,
+            'branch': self.branch,
+            'status': response['statusCode'],
+            'rows': self.rows,
+            'total_ms': round(total_ms, 2),
+            'phases_ms': {phase: round(seconds * 1000, 2) for phase, seconds in self.phases.items()},
+            'slow': slow,
+        }), flush=True)
+
+class TimedCursor(extensions.cursor):
+    # Курсор, возвращающий кортежи; время execute уходит в фазу query,
+    # fetch* — в фазу fetch. completed — число выполненных запросов
+    timer: Optional[RequestTimer] = None
+    completed = 0
+
+    def execute(self, query, vars=None):
+        if self.timer is None:
+            result = super().execute(query, vars)
+            self.completed += 1
+            return result
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+            self.completed += 1
+            return result
+        finally:
+            self.timer.add('query', time.perf_counter() - started)
+
+    def _timed_fetch(self, fetch, *args):
+        if self.timer is None:
+            return fetch(*args)
+        started = time.perf_counter()
+        result = fetch(*args)
+        self.timer.add('fetch', time.perf_counter() - started)
+        if isinstance(result, list):
+            self.timer.rows += len(result)
+        elif result is not None:
+            self.timer.rows += 1
+        return result
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+def hash_cancel_token(token: str) -> bytes:
+    # В БД хранится только SHA-256 токена, открытый токен есть лишь в ссылке отмены
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+def rows_to_dicts(cursor, rows: List[tuple]) -> List[Dict[str, Any]]:
+    # Имена колонок берутся из описания результата один раз на запрос
+    columns = [column.name for column in cursor.description]
+    return [dict(zip(columns, row)) for row in rows]
+
+class PreparedStatements:
+    '''
+    Реестр подготовленных операторов: оператор из statements готовится
+    PREPARE на соединении при первом использовании, дальше выполняется
+    EXECUTE без повторного разбора и планирования. Набор готовых операторов
+    хранится по соединению (слабая ссылка — закрытое и выброшенное пулом
+    соединение уходит из реестра само). Выключенный реестр выполняет тот же
+    SQL обычным запросом, подставляя $n как параметры psycopg2.
+    '''
+
+    def __init__(self, statements: Dict[str, Tuple[str, str]], enabled: bool):
+        self.statements = statements
+        self.enabled = enabled
+        self._plain = {
+            name: re.sub(r'\$(\d+)', r'%(p\1)s', sql) for name, (_, sql) in statements.items()
+        }
+        self._prepared: 'weakref.WeakKeyDictionary[Any, set]' = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def execute(self, conn, cursor, name: str, args: tuple = ()) -> None:
+        if not self.enabled:
+            cursor.execute(self._plain[name], {f'p{i}': value for i, value in enumerate(args, 1)})
+            return
+        # Соединение в каждый момент обслуживает один запрос, поэтому
+        # замок нужен только для самого словаря
+        with self._lock:
+            prepared = self._prepared.setdefault(conn, set())
+        if name not in prepared:
+            types, sql = self.statements[name]
+            cursor.execute(f"PREPARE {name}{f'({types})' if types else ''} AS {sql}")
+            prepared.add(name)
+        if args:
+            cursor.execute(f"EXECUTE {name}({', '.join(['%s'] * len(args))})", args)
+        else:
+            cursor.execute(f"EXECUTE {name}")
+
+    def prepared_on(self, conn) -> frozenset:
+        with self._lock:
+            return frozenset(self._prepared.get(conn, ()))
+
+prepared_statements = PreparedStatements(STATEMENTS, DB_PREPARED_STATEMENTS)
+
+class ConnectionPool:
+    '''
+    Пул соединений уровня модуля: не больше max_size открытых соединений,
+    простаивающие дольше idle_timeout закрываются, а соединение, которое
+    давно не использовалось, перед выдачей проверяется через SELECT 1 и
+    при обрыве молча заменяется новым.
+    '''
+
+    def __init__(self, max_size: int, idle_timeout: float, ping_interval: float):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self._idle: List[Tuple[Any, float]] = []
+        self._opened = 0
+        self._cond = threading.Condition()
+
+    def _is_alive(self, conn, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - idle_since < self.ping_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._opened -= 1
+            self._cond.notify()
+
+    def getconn(self, timeout: float = DB_POOL_ACQUIRE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                self._evict_expired()
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                elif self._opened < self.max_size:
+                    self._opened += 1
+                    conn, idle_since = None, 0.0
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolError('connection pool exhausted')
+                    self._cond.wait(remaining)
+                    continue
+
+            if conn is None:
+                try:
+                    return get_db_connection()
+                except Exception:
+                    with self._cond:
+                        self._opened -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_alive(conn, idle_since):
+                return conn
+            # Соединение оборвалось — закрываем и пробуем следующее или новое
+            self._discard(conn)
+
+    def putconn(self, conn, close: bool = False) -> None:
+        if not close and not conn.closed:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+        if close or conn.closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def clear_idle(self) -> None:
+        # После обрыва одного соединения остальные простаивающие, скорее
+        # всего, тоже мертвы (перезапуск БД, обрыв прокси)
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        fresh = []
+        for conn, idle_since in self._idle:
+            if now - idle_since > self.idle_timeout:
+                try:
+                    conn.close()
+                except psycopg2.Error:
+                    pass
+                self._opened -= 1
+            else:
+                fresh.append((conn, idle_since))
+        self._idle = fresh
+
+db_pool = ConnectionPool(DB_POOL_MAX_SIZE, DB_POOL_IDLE_TIMEOUT, DB_POOL_PING_INTERVAL)
+
+class StaleConnectionError(Exception):
+    '''Соединение оборвалось до первого выполненного запроса'''
+
+class RequestDb:
+    '''
+    Соединение запроса, которое берётся из пула только при первом обращении:
+    ответы 405, 400 и 304 из кэша не открывают соединение вовсе.
+    Чтение работает в autocommit-сессии только для чтения (без BEGIN/ROLLBACK
+    вокруг каждого запроса), запись — в обычной транзакции. Режим сессии
+    переключается, только если соединение из пула было в другом режиме.
+    '''
+
+    def __init__(self, timer: RequestTimer, read_only: bool):
+        self.timer = timer
+        self.read_only = read_only
+        self.conn = None
+        self.broken = False
+        self._cursor = None
+
+    def connection(self):
+        if self.conn is None:
+            started = time.perf_counter()
+            conn = db_pool.getconn()
+            try:
+                if self.read_only:
+                    if not (conn.autocommit and conn.readonly):
+                        conn.set_session(readonly=True, autocommit=True)
+                elif conn.autocommit or conn.readonly:
+                    conn.set_session(readonly='default', autocommit=False)
+            except psycopg2.Error:
+                db_pool.putconn(conn, close=True)
+                raise
+            self.conn = conn
+            if self.timer.enabled:
+                self.timer.add('connect', time.perf_counter() - started)
+        return self.conn
+
+    def cursor(self):
+        if self._cursor is None:
+            self._cursor = self.connection().cursor(cursor_factory=TimedCursor)
+            self._cursor.timer = self.timer if self.timer.enabled else None
+        return self._cursor
+
+    def execute(self, statement: str, args: tuple = ()):
+        # Запрос из STATEMENTS через реестр подготовленных операторов
+        cursor = self.cursor()
+        prepared_statements.execute(self.conn, cursor, statement, args)
+        return cursor
+
+    def untouched(self) -> bool:
+        # Ни один запрос запроса не выполнился: повтор на другом соединении безопасен
+        return self._cursor is None or self._cursor.completed == 0
+
+    def rollback(self) -> None:
+        if self.conn is not None and not self.broken:
+            self.conn.rollback()
+
+    def release(self) -> None:
+        if self.conn is None:
+            return
+        if self._cursor is not None and not self._cursor.closed:
+            self._cursor.close()
+        db_pool.putconn(self.conn, close=self.broken)
+        self.conn = None
+        self._cursor = None
+
+def encode_page_cursor(booking_date: date, booking_time: str, booking_id: int) -> str:
+    raw = json.dumps([booking_date.isoformat(), booking_time, booking_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_page_cursor(cursor: str) -> Tuple[date, str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        booking_date, booking_time, booking_id = json.loads(raw)
+        return datetime.strptime(booking_date, '%Y-%m-%d').date(), str(booking_time), int(booking_id)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise ValueError('invalid cursor') from e
+
+def parse_page_limit(value: Optional[str]) -> int:
+    if not value:
+        return PAGE_DEFAULT_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, PAGE_MAX_LIMIT)
+
+def fetch_bookings_page(conn, timer: RequestTimer, limit: int, after: Optional[Tuple[date, str, int]]) -> str:
+    # Серверный именованный курсор: строки читаются и кодируются в JSON
+    # порциями по PAGE_FETCH_CHUNK, без сборки всего результата в памяти
+    query = f"SELECT {', '.join(PAGE_COLUMNS)} FROM bookings WHERE {ACTIVE_LIST_WHERE}"
+    args: List[Any] = []
+    if after:
+        query += " AND (booking_date, booking_time, id) > (%s, %s, %s)"
+        args.extend(after)
+    query += " ORDER BY booking_date, booking_time, id LIMIT %s"
+    # Лишняя строка показывает, есть ли следующая страница
+    args.append(limit + 1)
+    
+    parts = []
+    count = 0
+    last = None
+    # В autocommit-сессии именованный курсор возможен только WITH HOLD;
+    # LIMIT ограничивает то, что сервер материализует
+    with conn.cursor(name='bookings_page', cursor_factory=TimedCursor, withhold=True) as cur:
+        cur.timer = timer if timer.enabled else None
+        cur.execute(query, args)
+        while count < limit:
+            rows = cur.fetchmany(min(PAGE_FETCH_CHUNK, limit - count))
+            if not rows:
+                break
+            count += len(rows)
+            last = rows[-1]
+            parts.append(timer.dumps([dict(zip(PAGE_COLUMNS, r)) for r in rows], default=str)[1:-1])
+        has_more = count == limit and cur.fetchone() is not None
+    
+    next_cursor = None
+    if has_more and last is not None:
+        row = dict(zip(PAGE_COLUMNS, last))
+        next_cursor = encode_page_cursor(row['booking_date'], row['booking_time'], row['id'])
+    
+    return '{"bookings": [' + ', '.join(parts) + '], "next": ' + json.dumps(next_cursor) + '}'
+
+class SlotsCache:
+    '''
+    LRU-кэш с TTL: дата -> занятые на неё время. Запись вытесняется по
+    истечении ttl или когда кэш превышает max_size. POST и DELETE
+    сбрасывают дату сразу после коммита, изменения других контейнеров
+    и бота приходят через ChangeFeed; TTL ограничивает устаревание,
+    пока лента недоступна.
+    '''
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: 'OrderedDict[date, Tuple[float, frozenset]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: date) -> Optional[frozenset]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: date, value: frozenset) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: date) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+slots_cache = SlotsCache(SLOTS_CACHE_MAX_SIZE, SLOTS_CACHE_TTL)
+
+class ChangeFeed:
+    '''
+    Подписка контейнера на канал bookings_changes. LISTEN держит соединение,
+    взятое из db_pool и не возвращаемое туда, пока подписка жива; drain()
+    перед чтением кэша забирает уже пришедшие уведомления без запроса к БД и
+    сбрасывает их даты в slots_cache. Молча оборванный сокет не даёт ни
+    данных, ни ошибки, поэтому соединение, не проверявшееся дольше
+    ping_interval пула, проверяется через SELECT 1 — как простаивающие
+    соединения в пуле. Пока соединения нет, события могут теряться, поэтому
+    после (пере)подключения кэш очищается целиком; неудачное подключение
+    повторяется не чаще retry_interval, а кэш живёт по TTL.
+    '''
+
+    def __init__(self, pool: ConnectionPool, cache: SlotsCache, channel: str, enabled: bool, retry_interval: float):
+        self.pool = pool
+        self.cache = cache
+        self.channel = channel
+        # Из пула в одно соединение подписка забрала бы его у запросов
+        self.enabled = enabled and pool.max_size > 1
+        self.retry_interval = retry_interval
+        self.events = 0
+        self._conn = None
+        self._checked_at = 0.0
+        self._next_attempt = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> None:
+        # Без ожидания: занятый пул — повод подождать retry_interval, а не
+        # задерживать запрос на DB_POOL_ACQUIRE_TIMEOUT
+        conn = self.pool.getconn(timeout=0)
+        try:
+            conn.set_session(readonly=False, autocommit=True)
+            with conn.cursor() as cur:
+                cur.execute('LISTEN ' + self.channel)
+        except psycopg2.Error:
+            self.pool.putconn(conn, close=True)
+            raise
+        self._conn = conn
+        self._checked_at = time.monotonic()
+        self.cache.clear()
+
+    def _disconnect(self) -> None:
+        # В пул соединение с LISTEN не возвращается: закрытие освобождает место
+        self.pool.putconn(self._conn, close=True)
+        self._conn = None
+        self._next_attempt = time.monotonic() + self.retry_interval
+
+    def _receive(self) -> None:
+        if time.monotonic() - self._checked_at >= self.pool.ping_interval:
+            # Уведомления, пришедшие до ответа на SELECT 1, psycopg2 кладёт в notifies
+            with self._conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            self._checked_at = time.monotonic()
+        else:
+            self._conn.poll()
+
+    def drain(self) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._conn is None:
+                if time.monotonic() < self._next_attempt:
+                    return
+                try:
+                    self._connect()
+                except psycopg2.Error as e:
+                    print(f"Change feed unavailable: {e}")
+                    self._next_attempt = time.monotonic() + self.retry_interval
+                    return
+            try:
+                self._receive()
+            except psycopg2.Error as e:
+                print(f"Change feed lost: {e}")
+                self._disconnect()
+                self.cache.clear()
+                return
+            while self._conn.notifies:
+                notify = self._conn.notifies.pop(0)
+                self.events += 1
+                try:
+                    day = datetime.strptime(json.loads(notify.payload)['date'], '%Y-%m-%d').date()
+                except (ValueError, KeyError, TypeError):
+                    self.cache.clear()
+                    continue
+                self.cache.invalidate(day)
+
+change_feed = ChangeFeed(db_pool, slots_cache, CHANGE_FEED_CHANNEL, CHANGE_FEED_ENABLED, CHANGE_FEED_RETRY_INTERVAL)
+
+def get_booked_times(db: RequestDb, days: List[date]) -> Dict[date, frozenset]:
+    # Занятые слоты по дням: из кэша, недостающие дни — одним запросом
+    change_feed.drain()
+    result = {}
+    missing = []
+    for day in days:
+        cached = slots_cache.get(day)
+        if cached is None:
+            missing.append(day)
+        else:
+            result[day] = cached
+    if missing:
+        cursor = db.execute('booked_times', (missing,))
+        fetched: Dict[date, set] = {day: set() for day in missing}
+        for booking_date, booking_time in cursor.fetchall():
+            fetched[booking_date].add(booking_time)
+        for day, times in fetched.items():
+            result[day] = frozenset(times)
+            slots_cache.put(day, result[day])
+    return result
+
+def validate_booking_data(item: Any) -> Optional[str]:
+    if not isinstance(item, dict):
+        return 'Ожидается объект записи'
+    fields = [item.get(f) for f in ('service', 'booking_date', 'booking_time', 'customer_name', 'customer_phone')]
+    if not all(fields):
+        return 'Все поля обязательны'
+    try:
+        datetime.strptime(str(item['booking_date']), '%Y-%m-%d')
+    except ValueError:
+        return 'Неверная дата'
+    if not BOOKING_TIME_RE.match(str(item['booking_time'])):
+        return 'Неверное время'
+    return None
+
+def get_service_duration(service: str) -> int:
+    return SERVICE_DURATIONS.get(service, DEFAULT_SERVICE_DURATION)
+
+def create_bookings_bulk(conn, cursor, items: List[Any], atomic: bool) -> Tuple[int, Dict[str, Any]]:
+    # Пакет записей: проверка всех элементов заранее, затем одна вставка
+    # execute_values с ON CONFLICT, которая одновременно и проверяет слоты
+    # (уникальный индекс и ограничение на пересечение интервалов)
+    results: List[Dict[str, Any]] = [{'index': i} for i in range(len(items))]
+    valid: List[Tuple[int, date]] = []
+    for i, item in enumerate(items):
+        error = validate_booking_data(item)
+        if error:
+            results[i].update(status=400, error=error)
+        else:
+            valid.append((i, datetime.strptime(str(item['booking_date']), '%Y-%m-%d').date()))
+    
+    if atomic and len(valid) < len(items):
+        return 400, {'created': 0, 'results': results}
+    
+    inserted: Dict[Tuple[date, str], Dict[str, Any]] = {}
+    if valid:
+        tokens = {i: secrets.token_urlsafe(32) for i, _ in valid}
+        rows = [
+            (
+                items[i]['service'], items[i]['booking_date'], items[i]['booking_time'],
+                items[i]['customer_name'], items[i]['customer_phone'], hash_cancel_token(tokens[i]),
+                get_service_duration(items[i]['service'])
+            )
+            for i, _ in valid
+        ]
+        created = execute_values(
+            cursor,
+            f"""INSERT INTO bookings
+            (service, booking_date, booking_time, customer_name, customer_phone, cancel_token_hash, duration_minutes)
+            VALUES %s
+            ON CONFLICT DO NOTHING
+            RETURNING {BOOKING_SELECT}""",
+            rows,
+            page_size=len(rows),
+            fetch=True
+        )
+        for booking in rows_to_dicts(cursor, created):
+            inserted[(booking['booking_date'], booking['booking_time'])] = booking
+    
+    created_count = 0
+    for i, day in valid:
+        # Повтор слота внутри пакета получает конфликт, как и занятый слот
+        booking = inserted.pop((day, items[i]['booking_time']), None)
+        if booking:
+            results[i].update(status=201, booking={**booking, 'cancel_token': tokens[i]})
+            created_count += 1
+        else:
+            results[i].update(status=409, error='Это время уже занято')
+    
+    if atomic and created_count < len(items):
+        conn.rollback()
+        for r in results:
+            if r['status'] == 201:
+                r.update(status=424, error='Пакет отменён из-за ошибки в другой записи')
+                del r['booking']
+        return 409, {'created': 0, 'results': results}
+    
+    conn.commit()
+    for _, day in valid:
+        slots_cache.invalidate(day)
+    
+    status = 201 if created_count == len(items) else 207
+    return status, {'created': created_count, 'results': results}
+
+def parse_booking_ids(value: str) -> List[int]:
+    ids = [int(part) for part in value.split(',') if part.strip()]
+    if not ids or len(ids) > BULK_MAX_ITEMS:
+        raise ValueError(f'от 1 до {BULK_MAX_ITEMS} id')
+    return ids
+
+def cancel_bookings_bulk(db: RequestDb, ids: Optional[List[int]], day: Optional[str]) -> Dict[str, Any]:
+    # Отмена списка записей или всех активных записей дня одним UPDATE
+    # в одной транзакции; уже отменённые и несуществующие id — в missing
+    if ids is not None:
+        cursor = db.execute('cancel_by_ids', (ids,))
+    else:
+        cursor = db.execute('cancel_day', (day,))
+    cancelled = rows_to_dicts(cursor, cursor.fetchall())
+    db.conn.commit()
+    for day_cancelled in {booking['booking_date'] for booking in cancelled}:
+        slots_cache.invalidate(day_cancelled)
+    
+    found = {booking['id'] for booking in cancelled}
+    return {
+        'cancelled': cancelled,
+        'missing': [i for i in dict.fromkeys(ids) if i not in found] if ids is not None else []
+    }
+
+def hash_request_body(body_data: Any) -> bytes:
+    # Тело в каноническом виде: пробелы и порядок полей не делают повтор другим запросом
+    canonical = json.dumps(body_data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).digest()
+
+def replay_idempotent_booking(db: RequestDb, timer: RequestTimer, headers: Dict[str, str],
+                              key_hash: bytes, request_hash: bytes) -> Optional[Dict[str, Any]]:
+    # Повтор с уже использованным ключом: 201 с исходной записью или 422,
+    # если ключ пришёл с другим телом. None — ключ новый
+    cursor = db.execute('idempotent_booking', (key_hash, IDEMPOTENCY_KEY_TTL_HOURS))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    booking = rows_to_dicts(cursor, [row])[0]
+    stored_hash = booking.pop('request_hash')
+    if stored_hash is not None and bytes(stored_hash) != request_hash:
+        timer.branch = 'create_key_reused'
+        return {
+            'statusCode': 422,
+            'headers': headers,
+            'body': json.dumps({'error': 'Idempotency-Key уже использован с другими данными записи'}),
+            'isBase64Encoded': False
+        }
+    timer.branch = 'create_replay'
+    return {
+        'statusCode': 201,
+        'headers': {**headers, 'Idempotent-Replayed': 'true'},
+        'body': timer.dumps(booking, default=str),
+        'isBase64Encoded': False
+    }
+
+def cleanup_idempotency_keys(db: RequestDb) -> None:
+    # Удаление порции просроченных ключей; запускается у малой доли запросов,
+    # чтобы не держать отдельный планировщик. Запись к этому моменту уже
+    # закоммичена, поэтому сбой очистки только пишется в лог
+    if random.random() >= IDEMPOTENCY_CLEANUP_RATE:
+        return
+    try:
+        db.cursor().execute(
+            "DELETE FROM booking_idempotency_keys WHERE key_hash IN ("
+            "SELECT key_hash FROM booking_idempotency_keys "
+            "WHERE created_at < CURRENT_TIMESTAMP - make_interval(hours => %s) LIMIT %s)",
+            (IDEMPOTENCY_KEY_TTL_HOURS, IDEMPOTENCY_CLEANUP_BATCH)
+        )
+        db.conn.commit()
+    except psycopg2.Error as e:
+        print(f"Idempotency key cleanup failed: {e}")
+        db.broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        db.rollback()
+
+def get_schedule_times(day: date) -> List[str]:
+    # График работы тот же, что в get_available_times телеграм-бота:
+    # вт и чт — выходные, сб и вс — 9-20, остальные дни — 11-14 и 17-20
+    day_of_week = day.weekday()
+    if day_of_week in [1, 3]:
+        return []
+    if day_of_week in [5, 6]:
+        return [f"{h}:00" for h in range(9, 20)]
+    return [f"{h}:00" for h in range(11, 14)] + [f"{h}:00" for h in range(17, 20)]
+
+def parse_date_range(date_from: str, date_to: str, max_days: int = AVAILABILITY_MAX_DAYS) -> Tuple[date, date]:
+    start = datetime.strptime(date_from, '%Y-%m-%d').date()
+    end = datetime.strptime(date_to, '%Y-%m-%d').date()
+    if end < start:
+        raise ValueError('to раньше from')
+    if (end - start).days >= max_days:
+        raise ValueError(f'Диапазон не больше {max_days} дней')
+    return start, end
+
+def get_booking_stats(db: RequestDb, start: date, end: date) -> Dict[str, Any]:
+    cursor = db.execute('booking_stats', (start, end))
+    # Биты grouping(): 8 — booking_date, 4 — service, 2 — weekday, 1 — booking_time
+    by_day_mask, by_service_mask, by_slot_mask = 0b0111, 0b1011, 0b1100
+    stats: Dict[str, Any] = {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'booked': 0,
+        'cancelled': 0,
+        'cancellation_rate': 0.0,
+        'days': [],
+        'services': [],
+        'weekday_slots': [],
+    }
+    for grp, booking_date, service, weekday, booking_time, booked, cancelled in cursor.fetchall():
+        counts = {'booked': int(booked), 'cancelled': int(cancelled)}
+        if grp == by_day_mask:
+            stats['days'].append({'date': booking_date.isoformat(), **counts})
+        elif grp == by_service_mask:
+            stats['services'].append({'service': service, **counts})
+        elif grp == by_slot_mask:
+            stats['weekday_slots'].append({'weekday': weekday, 'time': booking_time, **counts})
+        else:
+            stats.update(counts)
+    if stats['booked']:
+        stats['cancellation_rate'] = round(stats['cancelled'] / stats['booked'], 4)
+    return stats
+
+def get_request_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    # Заголовки приходят в произвольном регистре
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+def is_admin_request(event: Dict[str, Any]) -> bool:
+    # Сравнение за постоянное время, чтобы токен нельзя было подобрать по задержке
+    token = get_request_header(event, 'X-Admin-Token')
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+def compute_etag(db: RequestDb, statement: str, args: tuple, variant: str = '') -> str:
+    count, last_updated = db.execute(statement, args).fetchone()
+    raw = f"{count}|{last_updated}|{variant}".encode('utf-8')
+    return 'W/"' + hashlib.sha1(raw).hexdigest()[:20] + '"'
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    if_none_match = get_request_header(event, 'If-None-Match')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # Слабое сравнение: префикс W/ не учитывается
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+def not_modified_response(headers: Dict[str, str], etag: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {**headers, 'ETag': etag},
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    # Кодировка с наибольшим q из поддерживаемых; при равном q — br
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    wildcard = weights.get('*', 0.0)
+    candidates = [('br', weights.get('br', wildcard))] if brotli is not None else []
+    candidates.append(('gzip', weights.get('gzip', wildcard)))
+    encoding, q = max(candidates, key=lambda c: c[1])
+    return encoding if q > 0 else None
+
+def compress_response(event: Dict[str, Any], response: Dict[str, Any], timer: RequestTimer) -> None:
+    # Тело зависит от Accept-Encoding, поэтому Vary ставится и на несжатые ответы
+    response['headers']['Vary'] = 'Accept-Encoding'
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded') or len(body) < COMPRESS_MIN_BYTES:
+        return
+    encoding = choose_encoding(get_request_header(event, 'Accept-Encoding'))
+    if encoding is None:
+        return
+    
+    started = time.perf_counter()
+    raw = body.encode('utf-8')
+    if encoding == 'br':
+        compressed = brotli.compress(raw, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(raw, compresslevel=GZIP_LEVEL)
+    response['body'] = base64.b64encode(compressed).decode('ascii')
+    response['isBase64Encoded'] = True
+    response['headers']['Content-Encoding'] = encoding
+    if timer.enabled:
+        timer.add('compress', time.perf_counter() - started)
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    timer = RequestTimer(event.get('httpMethod', 'GET'), REQUEST_TIMING)
+    try:
+        response = handle_request(event, timer, retry_stale=True)
+    except StaleConnectionError:
+        # Соединение из пула умерло раньше, чем проверка SELECT 1 после
+        # простоя успела это заметить: один повтор на новом соединении
+        db_pool.clear_idle()
+        response = handle_request(event, timer, retry_stale=False)
+    if event.get('httpMethod') != 'OPTIONS':
+        compress_response(event, response, timer)
+    timer.finish(response)
+    return response
+
+def handle_request(event: Dict[str, Any], timer: RequestTimer, retry_stale: bool = False) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     # Handle CORS OPTIONS request
@@ -26,7 +1090,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Admin-Token, If-None-Match, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -35,11 +1099,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     headers = {
         'Content-Type': 'application/json',
-        'Access-Control-Allow-Origin': '*'
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag, Server-Timing'
     }
     
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    # Соединение берётся только ветками, которые обращаются к БД
+    db = RequestDb(timer, read_only=method == 'GET')
     
     try:
         # GET - получить все записи или одну по токену
@@ -48,11 +1113,71 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             cancel_token = params.get('token')
             date_filter = params.get('date')
             
+            # Аналитика за диапазон из сводки booking_stats
+            if params.get('stats'):
+                timer.branch = 'stats'
+                try:
+                    start, end = parse_date_range(params.get('from') or '', params.get('to') or '', STATS_MAX_DAYS)
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': headers,
+                        'body': json.dumps({'error': f'Неверный диапазон дат: {e}'}),
+                        'isBase64Encoded': False
+                    }
+                
+                body = timer.dumps(get_booking_stats(db, start, end))
+                etag = 'W/"' + hashlib.sha1(body.encode('utf-8')).hexdigest()[:20] + '"'
+                if etag_matches(event, etag):
+                    return not_modified_response(headers, etag)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {**headers, 'ETag': etag, 'Cache-Control': 'no-cache'},
+                    'body': body,
+                    'isBase64Encoded': False
+                }
+            
+            # Свободные слоты по дням за диапазон одним запросом
+            if params.get('availability'):
+                timer.branch = 'availability'
+                try:
+                    start, end = parse_date_range(params.get('from') or '', params.get('to') or '')
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': headers,
+                        'body': json.dumps({'error': f'Неверный диапазон дат: {e}'}),
+                        'isBase64Encoded': False
+                    }
+                
+                range_days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+                booked = get_booked_times(db, range_days)
+                
+                days = {}
+                for day in range_days:
+                    taken = booked[day]
+                    days[day.isoformat()] = [t for t in get_schedule_times(day) if t not in taken]
+                
+                # Версия считается по самому ответу — без отдельного запроса к БД
+                body = timer.dumps({'from': start.isoformat(), 'to': end.isoformat(), 'days': days})
+                etag = 'W/"' + hashlib.sha1(body.encode('utf-8')).hexdigest()[:20] + '"'
+                if etag_matches(event, etag):
+                    return not_modified_response(headers, etag)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {**headers, 'ETag': etag, 'Cache-Control': 'no-cache'},
+                    'body': body,
+                    'isBase64Encoded': False
+                }
+            
             if cancel_token:
-                cursor.execute(
-                    "SELECT * FROM bookings WHERE cancel_token = %s",
-                    (cancel_token,)
-                )
+                timer.branch = 'token'
+                if date_filter:
+                    cursor = db.execute('booking_by_token_and_date', (hash_cancel_token(cancel_token), date_filter))
+                else:
+                    cursor = db.execute('booking_by_token', (hash_cancel_token(cancel_token),))
                 booking = cursor.fetchone()
                 if not booking:
                     return {
@@ -64,26 +1189,52 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 return {
                     'statusCode': 200,
                     'headers': headers,
-                    'body': json.dumps(dict(booking), default=str),
+                    'body': timer.dumps(rows_to_dicts(cursor, [booking])[0], default=str),
                     'isBase64Encoded': False
                 }
             
-            # Получить все записи (для админ-панели)
+            # Записи на конкретную дату
             if date_filter:
-                cursor.execute(
-                    "SELECT * FROM bookings WHERE booking_date = %s ORDER BY booking_time",
-                    (date_filter,)
-                )
-            else:
-                cursor.execute(
-                    "SELECT * FROM bookings WHERE status = 'active' ORDER BY booking_date, booking_time"
-                )
+                timer.branch = 'date'
+                etag = compute_etag(db, 'etag_by_date', (date_filter,), 'date')
+                if etag_matches(event, etag):
+                    return not_modified_response(headers, etag)
+                
+                cursor = db.execute('bookings_by_date', (date_filter,))
+                bookings = cursor.fetchall()
+                return {
+                    'statusCode': 200,
+                    'headers': {**headers, 'ETag': etag, 'Cache-Control': 'no-cache'},
+                    'body': timer.dumps(rows_to_dicts(cursor, bookings), default=str),
+                    'isBase64Encoded': False
+                }
+            
+            # Все активные записи (для админ-панели) — постранично по ключу
+            timer.branch = 'list'
+            try:
+                limit = parse_page_limit(params.get('limit'))
+                after = decode_page_cursor(params['after']) if params.get('after') else None
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'Неверные параметры limit или after'}),
+                    'isBase64Encoded': False
+                }
+            
+            etag = compute_etag(
+                db,
+                'etag_active_list',
+                (),
+                f"page:{limit}:{params.get('after') or ''}"
+            )
+            if etag_matches(event, etag):
+                return not_modified_response(headers, etag)
             
-            bookings = cursor.fetchall()
             return {
                 'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps([dict(b) for b in bookings], default=str),
+                'headers': {**headers, 'ETag': etag, 'Cache-Control': 'no-cache'},
+                'body': fetch_bookings_page(db.connection(), timer, limit, after),
                 'isBase64Encoded': False
             }
         
@@ -91,27 +1242,100 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             
+            # Пакетное создание: массив записей одной транзакцией
+            if isinstance(body_data, list):
+                timer.branch = 'bulk_create'
+                params = event.get('queryStringParameters', {}) or {}
+                if not body_data or len(body_data) > BULK_MAX_ITEMS:
+                    return {
+                        'statusCode': 400,
+                        'headers': headers,
+                        'body': json.dumps({'error': f'Ожидается от 1 до {BULK_MAX_ITEMS} записей'}),
+                        'isBase64Encoded': False
+                    }
+                
+                status, payload = create_bookings_bulk(
+                    db.connection(), db.cursor(), body_data, params.get('atomic') in ('1', 'true')
+                )
+                return {
+                    'statusCode': status,
+                    'headers': headers,
+                    'body': timer.dumps(payload, default=str),
+                    'isBase64Encoded': False
+                }
+            
+            # Одиночная запись — только объект: строка, число или null
+            # не дойдут до body_data.get и не обернутся ошибкой 500
+            if not isinstance(body_data, dict):
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'Ожидается объект записи'}),
+                    'isBase64Encoded': False
+                }
+            
+            # Повтор с тем же Idempotency-Key получает исходную запись
+            # без повторной проверки и вставки
+            key_hash = None
+            request_hash = None
+            idempotency_key = get_request_header(event, 'Idempotency-Key')
+            if idempotency_key:
+                if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                    return {
+                        'statusCode': 400,
+                        'headers': headers,
+                        'body': json.dumps({'error': 'Слишком длинный Idempotency-Key'}),
+                        'isBase64Encoded': False
+                    }
+                key_hash = hashlib.sha256(idempotency_key.encode('utf-8')).digest()
+                request_hash = hash_request_body(body_data)
+                replayed = replay_idempotent_booking(db, timer, headers, key_hash, request_hash)
+                if replayed:
+                    return replayed
+            
             service = body_data.get('service')
             booking_date = body_data.get('booking_date')
             booking_time = body_data.get('booking_time')
             customer_name = body_data.get('customer_name')
             customer_phone = body_data.get('customer_phone')
             
-            if not all([service, booking_date, booking_time, customer_name, customer_phone]):
+            timer.branch = 'create'
+            error = validate_booking_data(body_data)
+            if error:
                 return {
                     'statusCode': 400,
                     'headers': headers,
-                    'body': json.dumps({'error': 'Все поля обязательны'}),
+                    'body': json.dumps({'error': error}),
                     'isBase64Encoded': False
                 }
             
-            # Проверка на существующую запись в это время
-            cursor.execute(
-                "SELECT id FROM bookings WHERE booking_date = %s AND booking_time = %s AND status = 'active'",
-                (booking_date, booking_time)
+            cancel_token = secrets.token_urlsafe(32)
+            
+            # Вставка с проверкой слота и сохранением ключа — см. STATEMENTS['create_booking']
+            cursor = db.execute(
+                'create_booking',
+                (service, booking_date, booking_time, customer_name, customer_phone, hash_cancel_token(cancel_token),
+                 get_service_duration(service), key_hash, request_hash, IDEMPOTENCY_KEY_TTL_HOURS)
             )
-            existing = cursor.fetchone()
-            if existing:
+            
+            new_booking = cursor.fetchone()
+            if new_booking and not new_booking[-1]:
+                # key_saved (последняя колонка) = false: ключ уже занят записью параллельного запроса: эта вставка отменяется
+                db.conn.rollback()
+                new_booking = None
+            else:
+                db.conn.commit()
+            # И при успехе, и при конфликте закэшированные слоты дня устарели
+            slots_cache.invalidate(datetime.strptime(booking_date, '%Y-%m-%d').date())
+            
+            if not new_booking and key_hash:
+                # Параллельный повтор с тем же ключом мог успеть создать запись
+                replayed = replay_idempotent_booking(db, timer, headers, key_hash, request_hash)
+                if replayed:
+                    db.conn.commit()
+                    return replayed
+            
+            if not new_booking:
                 return {
                     'statusCode': 409,
                     'headers': headers,
@@ -119,42 +1343,67 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            cancel_token = secrets.token_urlsafe(32)
-            
-            cursor.execute(
-                """INSERT INTO bookings 
-                (service, booking_date, booking_time, customer_name, customer_phone, cancel_token)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING *""",
-                (service, booking_date, booking_time, customer_name, customer_phone, cancel_token)
-            )
-            
-            new_booking = cursor.fetchone()
-            conn.commit()
+            new_booking = rows_to_dicts(cursor, [new_booking])[0]
+            del new_booking['key_saved']
+            # Открытый токен отдаётся один раз — для ссылки отмены
+            new_booking['cancel_token'] = cancel_token
+            if key_hash:
+                cleanup_idempotency_keys(db)
             
             return {
                 'statusCode': 201,
                 'headers': headers,
-                'body': json.dumps(dict(new_booking), default=str),
+                'body': timer.dumps(new_booking, default=str),
                 'isBase64Encoded': False
             }
         
         # DELETE - отменить запись (по токену или по ID для админа)
         elif method == 'DELETE':
+            timer.branch = 'cancel'
             params = event.get('queryStringParameters', {}) or {}
             cancel_token = params.get('token')
             booking_id = params.get('id')
+            # Необязательная дата записи сужает поиск по id или токену до одной секции
+            booking_date = params.get('date')
             
-            if cancel_token:
-                cursor.execute(
-                    "UPDATE bookings SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE cancel_token = %s RETURNING *",
-                    (cancel_token,)
-                )
+            # Пакетная отмена для админа: ?ids=1,2,3 или весь день ?date= без id
+            if params.get('ids') or (booking_date and not booking_id and not cancel_token):
+                timer.branch = 'bulk_cancel'
+                if not is_admin_request(event):
+                    return {
+                        'statusCode': 401,
+                        'headers': headers,
+                        'body': json.dumps({'error': 'Требуется X-Admin-Token'}),
+                        'isBase64Encoded': False
+                    }
+                try:
+                    ids = parse_booking_ids(params['ids']) if params.get('ids') else None
+                    if ids is None:
+                        datetime.strptime(booking_date, '%Y-%m-%d')
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': headers,
+                        'body': json.dumps({'error': f'Неверные ids или date: {e}'}),
+                        'isBase64Encoded': False
+                    }
+                
+                payload = cancel_bookings_bulk(db, ids, booking_date)
+                return {
+                    'statusCode': 200,
+                    'headers': headers,
+                    'body': timer.dumps(payload, default=str),
+                    'isBase64Encoded': False
+                }
+            
+            if cancel_token and booking_date:
+                cursor = db.execute('cancel_by_token_and_date', (hash_cancel_token(cancel_token), booking_date))
+            elif cancel_token:
+                cursor = db.execute('cancel_by_token', (hash_cancel_token(cancel_token),))
+            elif booking_id and booking_date:
+                cursor = db.execute('cancel_by_id_and_date', (booking_id, booking_date))
             elif booking_id:
-                cursor.execute(
-                    "UPDATE bookings SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING *",
-                    (booking_id,)
-                )
+                cursor = db.execute('cancel_by_id', (booking_id,))
             else:
                 return {
                     'statusCode': 400,
@@ -172,12 +1421,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            conn.commit()
+            db.conn.commit()
+            cancelled_booking = rows_to_dicts(cursor, [cancelled_booking])[0]
+            slots_cache.invalidate(cancelled_booking['booking_date'])
             
             return {
                 'statusCode': 200,
                 'headers': headers,
-                'body': json.dumps({'message': 'Запись отменена', 'booking': dict(cancelled_booking)}, default=str),
+                'body': timer.dumps({'message': 'Запись отменена', 'booking': cancelled_booking}, default=str),
                 'isBase64Encoded': False
             }
         
@@ -189,7 +1440,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     except Exception as e:
-        conn.rollback()
+        # Обрыв соединения — не возвращаем его в пул
+        db.broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        if db.broken and retry_stale and db.untouched():
+            raise StaleConnectionError() from e
+        db.rollback()
         return {
             'statusCode': 500,
             'headers': headers,
@@ -198,5 +1453,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     finally:
-        cursor.close()
-        conn.close()
+        db.release()
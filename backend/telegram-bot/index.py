@@ -6,168 +6,750 @@ Returns: HTTP response for Telegram webhook
 
 import json
 import os
-from typing import Dict, Any, Optional
-from datetime import datetime, timedelta
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from datetime import date, datetime, timedelta
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
-user_states = {}
+# Date picker window and how long its availability is shared between updates
+BOOKING_WINDOW_DAYS = 14
+DATE_PICKER_MAX_DAYS = 7
+AVAILABILITY_CACHE_TTL = float(os.environ.get('AVAILABILITY_CACHE_TTL', '10'))
 
-def send_telegram_message(chat_id: str, text: str, reply_markup: Optional[Dict] = None) -> None:
-    """Send message via Telegram Bot API"""
-    import urllib.request
-    
-    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
-    if not bot_token:
-        return
-    
-    url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
-    payload = {
-        'chat_id': chat_id,
-        'text': text,
-        'parse_mode': 'HTML'
-    }
-    
-    if reply_markup:
-        payload['reply_markup'] = reply_markup
-    
-    req = urllib.request.Request(
-        url,
-        data=json.dumps(payload).encode('utf-8'),
-        headers={'Content-Type': 'application/json'}
+# Conversation state backend: postgres (survives new containers) or memory (tests)
+BOT_STATE_BACKEND = os.environ.get('BOT_STATE_BACKEND', 'postgres')
+# How long an idle conversation keeps its step
+BOT_STATE_TTL_SECONDS = int(os.environ.get('BOT_STATE_TTL_SECONDS', str(24 * 3600)))
+# In-process LRU in front of the backend; the short TTL bounds how stale a chat
+# can be when another container handled its previous message
+BOT_STATE_CACHE_MAX_SIZE = int(os.environ.get('BOT_STATE_CACHE_MAX_SIZE', '1024'))
+BOT_STATE_CACHE_TTL = float(os.environ.get('BOT_STATE_CACHE_TTL', '30'))
+BOT_STATE_CLEANUP_RATE = float(os.environ.get('BOT_STATE_CLEANUP_RATE', '0.02'))
+BOT_STATE_CLEANUP_BATCH = 500
+# How many times an update is routed again after another container changed its chat's state
+BOT_STATE_MAX_REROUTES = 3
+# Steps whose route writes a booking and always ends the conversation
+BOOKING_WRITE_STEPS = frozenset({'enter_phone', 'admin_cancel'})
+
+# Server-side prepared statements; set to 0 behind PgBouncer in transaction mode,
+# where consecutive queries may run on different server connections
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') == '1'
+# Generic plans with run-time partition pruning instead of re-planning per date
+DB_PLAN_CACHE_MODE = os.environ.get('DB_PLAN_CACHE_MODE', 'force_generic_plan')
+# A connection idle for longer is checked with SELECT 1 before reuse
+DB_PING_INTERVAL = float(os.environ.get('DB_PING_INTERVAL', '30'))
+
+# Hot queries of the data functions: name -> (parameter types, SQL with $1..$n)
+STATEMENTS = {
+    'bot_booked_times': (
+        'date',
+        "SELECT booking_time FROM t_p16986787_loft_massage_site.bookings "
+        "WHERE booking_date = $1 AND status = 'active'"
+    ),
+    'bot_booked_times_range': (
+        'date, date',
+        "SELECT booking_date, booking_time FROM t_p16986787_loft_massage_site.bookings "
+        "WHERE booking_date BETWEEN $1 AND $2 AND status = 'active'"
+    ),
+    'bot_create_booking': (
+        'varchar, date, varchar, varchar, varchar, smallint',
+        "INSERT INTO t_p16986787_loft_massage_site.bookings "
+        "(service, booking_date, booking_time, customer_name, customer_phone, status, duration_minutes) "
+        "VALUES ($1, $2, $3, $4, $5, 'active', $6) "
+        "ON CONFLICT DO NOTHING "
+        "RETURNING id"
+    ),
+    'bot_user_bookings': (
+        'varchar',
+        "SELECT id, service, booking_date, booking_time "
+        "FROM t_p16986787_loft_massage_site.bookings "
+        "WHERE customer_phone = $1 AND status = 'active' AND booking_date >= CURRENT_DATE "
+        "ORDER BY booking_date, booking_time"
+    ),
+    'bot_cancel_booking': (
+        'integer',
+        "UPDATE t_p16986787_loft_massage_site.bookings "
+        "SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP "
+        "WHERE id = $1 AND status = 'active'"
+    ),
+    'bot_active_bookings': (
+        '',
+        "SELECT id, service, booking_date, booking_time, customer_name, customer_phone "
+        "FROM t_p16986787_loft_massage_site.bookings "
+        "WHERE status = 'active' AND booking_date >= CURRENT_DATE "
+        "ORDER BY booking_date, booking_time"
+    ),
+    'bot_load_state': (
+        'varchar',
+        "SELECT state, version FROM t_p16986787_loft_massage_site.bot_conversation_states "
+        "WHERE chat_id = $1 AND expires_at > CURRENT_TIMESTAMP"
+    ),
+    # State writes go through only over the version that was read; no row
+    # returned means another container changed the chat first.
+    # A chat read without a row (version 0) may only take a free or expired
+    # one; an unknown version ($4 NULL) overwrites whatever is there
+    'bot_save_state': (
+        'varchar, jsonb, integer, bigint',
+        "INSERT INTO t_p16986787_loft_massage_site.bot_conversation_states AS s (chat_id, state, expires_at, version) "
+        "VALUES ($1, $2, CURRENT_TIMESTAMP + make_interval(secs => $3), 1) "
+        "ON CONFLICT (chat_id) DO UPDATE "
+        "SET state = EXCLUDED.state, expires_at = EXCLUDED.expires_at, version = s.version + 1 "
+        "WHERE $4 IS NULL OR s.expires_at <= CURRENT_TIMESTAMP "
+        "RETURNING version"
+    ),
+    'bot_update_state': (
+        'varchar, jsonb, integer, bigint',
+        "UPDATE t_p16986787_loft_massage_site.bot_conversation_states "
+        "SET state = $2, expires_at = CURRENT_TIMESTAMP + make_interval(secs => $3), version = version + 1 "
+        "WHERE chat_id = $1 AND version = $4 "
+        "RETURNING version"
+    ),
+    'bot_delete_state': (
+        'varchar, bigint',
+        "DELETE FROM t_p16986787_loft_massage_site.bot_conversation_states "
+        "WHERE chat_id = $1 AND ($2 IS NULL OR version = $2 OR expires_at <= CURRENT_TIMESTAMP)"
+    ),
+    'bot_state_version': (
+        'varchar',
+        "SELECT version FROM t_p16986787_loft_massage_site.bot_conversation_states "
+        "WHERE chat_id = $1 AND expires_at > CURRENT_TIMESTAMP"
+    ),
+    'bot_expire_states': (
+        'integer',
+        "DELETE FROM t_p16986787_loft_massage_site.bot_conversation_states WHERE chat_id IN ("
+        "SELECT chat_id FROM t_p16986787_loft_massage_site.bot_conversation_states "
+        "WHERE expires_at <= CURRENT_TIMESTAMP LIMIT $1)"
+    ),
+}
+
+# Connection shared by warm invocations of the container, when it was last
+# released and the names of the statements already prepared on it
+_db_connection = None
+_db_idle_since = 0.0
+_prepared_statements = set()
+
+# Free times of the current booking window: (window start, loaded at, {date: times})
+_availability_cache: Optional[tuple] = None
+_availability_lock = threading.Lock()
+
+# Session length in minutes per service, mirrors MASSAGE_SERVICES in telegram-bot/bot.py
+SERVICE_DURATIONS = {
+    'Классический массаж спина': 30,
+    'Успокаивающий массаж спина': 30,
+    'Классический массаж тело': 60,
+    'Расслабляющий массаж тела': 60,
+}
+
+class JsonFragment(str):
+    """JSON encoded once at import and spliced into payloads as is"""
+
+def encode_keyboard(rows: list) -> JsonFragment:
+    """Reply keyboard of button texts, encoded once"""
+    return JsonFragment(json.dumps(
+        {'keyboard': [[{'text': text} for text in row] for row in rows], 'resize_keyboard': True},
+        ensure_ascii=False
+    ))
+
+BACK = '↩️ Назад'
+BOOK = '📅 Записаться на массаж'
+MY_BOOKINGS = '📋 Мои записи'
+ADMIN_LIST = '⚙️ Все записи (админ)'
+ADMIN_CANCEL = '❌ Отменить запись'
+
+MAIN_KEYBOARD = encode_keyboard([[BOOK], [MY_BOOKINGS]])
+ADMIN_KEYBOARD = encode_keyboard([[BOOK], [MY_BOOKINGS], [ADMIN_LIST, ADMIN_CANCEL]])
+SERVICES_KEYBOARD = encode_keyboard([[service] for service in SERVICE_DURATIONS] + [[BACK]])
+BOOK_OR_BACK_KEYBOARD = encode_keyboard([[BOOK], [BACK]])
+REMOVE_KEYBOARD = JsonFragment('{"remove_keyboard": true}')
+
+# json.dumps(..., ensure_ascii=False) builds a new encoder on every call
+_json_encoder = json.JSONEncoder(ensure_ascii=False)
+_encode_string = json.encoder.encode_basestring
+
+def build_message(chat_id: str, text: str, reply_markup: Any = None, method: Optional[str] = None) -> str:
+    """Encoded sendMessage parameters; a JsonFragment keyboard is not serialized again"""
+    body = (
+        (f'{{"method": "{method}", ' if method else '{')
+        + f'"chat_id": {_encode_string(str(chat_id))}, "text": {_encode_string(text)}, "parse_mode": "HTML"'
     )
-    
-    try:
-        urllib.request.urlopen(req)
-    except Exception:
-        pass
+    if reply_markup is None:
+        return body + '}'
+    if not isinstance(reply_markup, JsonFragment):
+        reply_markup = _json_encoder.encode(reply_markup)
+    return body + ', "reply_markup": ' + reply_markup + '}'
+
+def webhook_reply(chat_id: str, text: str, reply_markup: Any = None) -> str:
+    """Primary reply returned as the webhook response: Telegram performs it, no outbound request"""
+    return build_message(chat_id, text, reply_markup, method='sendMessage')
+
+def webhook_response(reply: Optional[str] = None) -> Dict[str, Any]:
+    """200 for Telegram carrying at most one Bot API call"""
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'isBase64Encoded': False,
+        'body': reply or '{"ok": true}'
+    }
 
 def get_db_connection():
-    """Get database connection using DATABASE_URL"""
-    database_url = os.environ.get('DATABASE_URL')
-    if not database_url:
-        raise ValueError('DATABASE_URL not set')
-    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+    """
+    Get the container's database connection, reconnecting if it was closed;
+    one idle for DB_PING_INTERVAL is pinged first and replaced if it has died
+    """
+    global _db_connection
+    if (_db_connection is not None and not _db_connection.closed
+            and time.monotonic() - _db_idle_since >= DB_PING_INTERVAL):
+        try:
+            with _db_connection.cursor() as cur:
+                cur.execute('SELECT 1')
+            _db_connection.rollback()
+        except psycopg2.Error:
+            close_db_connection()
+    if _db_connection is None or _db_connection.closed:
+        database_url = os.environ.get('DATABASE_URL')
+        if not database_url:
+            raise ValueError('DATABASE_URL not set')
+        _db_connection = psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+        if DB_PREPARED_STATEMENTS and DB_PLAN_CACHE_MODE:
+            with _db_connection.cursor() as cur:
+                cur.execute('SET plan_cache_mode = %s', (DB_PLAN_CACHE_MODE,))
+            _db_connection.commit()
+        _prepared_statements.clear()
+    return _db_connection
 
-def get_available_times(date_str: str) -> list:
-    """Get available time slots for a given date based on schedule"""
-    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-    day_of_week = date_obj.weekday()
+def release_db_connection(conn) -> None:
+    """End any open transaction so the shared connection stays idle between calls"""
+    global _db_idle_since
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        conn.close()
+    _db_idle_since = time.monotonic()
+
+def close_db_connection() -> None:
+    """Drop the shared connection; the next get_db_connection opens a new one"""
+    global _db_connection
+    if _db_connection is not None:
+        try:
+            _db_connection.close()
+        except psycopg2.Error:
+            pass
+        _db_connection = None
+
+def execute_statement(cur, name: str, args: tuple = ()) -> None:
+    """Run a query from STATEMENTS, preparing it on the connection on first use"""
+    types, sql = STATEMENTS[name]
+    if not DB_PREPARED_STATEMENTS:
+        cur.execute(re.sub(r'\$(\d+)', r'%(p\1)s', sql), {f'p{i}': value for i, value in enumerate(args, 1)})
+        return
+    if name not in _prepared_statements:
+        cur.execute(f"PREPARE {name}{f'({types})' if types else ''} AS {sql}")
+        _prepared_statements.add(name)
+    if args:
+        cur.execute(f"EXECUTE {name}({', '.join(['%s'] * len(args))})", args)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+class MemoryStateBackend:
+    """Conversation states in a dict of this process; for tests and local runs"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._data: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, chat_id: str) -> Optional[tuple]:
+        entry = self._data.get(chat_id)
+        if entry is not None and entry[0] <= time.monotonic():
+            del self._data[chat_id]
+            return None
+        return entry
+
+    def load(self, chat_id: str) -> Tuple[Dict[str, Any], int]:
+        with self._lock:
+            entry = self._live(chat_id)
+            return (dict(entry[2]), entry[1]) if entry is not None else ({}, 0)
+
+    def save(self, chat_id: str, state: Dict[str, Any], version: Optional[int]) -> Optional[int]:
+        with self._lock:
+            now = time.monotonic()
+            for key in [k for k, (expires, _, _) in self._data.items() if expires <= now]:
+                del self._data[key]
+            current = self._data.get(chat_id, (0, 0, None))[1]
+            if version is not None and current != version:
+                return None
+            self._data[chat_id] = (now + self.ttl, current + 1, dict(state))
+            return current + 1
+
+    def delete(self, chat_id: str, version: Optional[int]) -> bool:
+        with self._lock:
+            entry = self._live(chat_id)
+            if version is not None and (entry[1] if entry is not None else 0) != version:
+                return False
+            self._data.pop(chat_id, None)
+            return True
+
+class PostgresStateBackend:
+    """Conversation states in bot_conversation_states, shared by all containers"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    def load(self, chat_id: str) -> Tuple[Dict[str, Any], int]:
+        # The first query of an update: a connection that died within the ping
+        # interval fails here, and the read is safe to repeat on a new one
+        for attempt in range(2):
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cur:
+                    execute_statement(cur, 'bot_load_state', (chat_id,))
+                    row = cur.fetchone()
+                    return (row['state'], row['version']) if row else ({}, 0)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                close_db_connection()
+                if attempt:
+                    raise
+            finally:
+                release_db_connection(conn)
+
+    def save(self, chat_id: str, state: Dict[str, Any], version: Optional[int]) -> Optional[int]:
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                execute_statement(
+                    cur, 'bot_update_state' if version else 'bot_save_state',
+                    (chat_id, json.dumps(state, ensure_ascii=False), self.ttl, version)
+                )
+                row = cur.fetchone()
+                # Expired rows are removed by a small share of writes, no scheduler needed
+                if random.random() < BOT_STATE_CLEANUP_RATE:
+                    execute_statement(cur, 'bot_expire_states', (BOT_STATE_CLEANUP_BATCH,))
+                conn.commit()
+                return row['version'] if row else None
+        finally:
+            release_db_connection(conn)
+
+    def delete(self, chat_id: str, version: Optional[int]) -> bool:
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                execute_statement(cur, 'bot_delete_state', (chat_id, version))
+                if cur.rowcount == 0 and version:
+                    # The row read at this version was changed or removed by another writer
+                    return False
+                if cur.rowcount == 0 and version is not None:
+                    # Read without a row: fine unless another writer has created one since
+                    execute_statement(cur, 'bot_state_version', (chat_id,))
+                    if cur.fetchone() is not None:
+                        return False
+                conn.commit()
+                return True
+        finally:
+            release_db_connection(conn)
+
+class StateStore:
+    """
+    Write-through LRU in front of a state backend. A warm hit costs no I/O.
+    Every state carries the backend version it was read at, and a write goes
+    through only over that version, so a stale cached state (another container
+    handled the chat meanwhile) is detected instead of overwriting the newer one.
+    An empty state deletes the row instead of storing it
+    """
+
+    def __init__(self, backend, max_size: int, ttl: float):
+        self.backend = backend
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, chat_id: str, state: Dict[str, Any], version: Optional[int]) -> None:
+        with self._lock:
+            self._data[chat_id] = (time.monotonic(), dict(state), version)
+            self._data.move_to_end(chat_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def _forget(self, chat_id: str) -> None:
+        with self._lock:
+            self._data.pop(chat_id, None)
+
+    def get(self, chat_id: str) -> Tuple[Dict[str, Any], Optional[int]]:
+        """A copy of the chat's state and its version; pass both back to set()"""
+        with self._lock:
+            entry = self._data.get(chat_id)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._data.move_to_end(chat_id)
+                return dict(entry[1]), entry[2]
+        return self.reload(chat_id)
+
+    def reload(self, chat_id: str) -> Tuple[Dict[str, Any], Optional[int]]:
+        """The chat's state read from the backend, bypassing the cache"""
+        try:
+            state, version = self.backend.load(chat_id)
+        except psycopg2.Error as e:
+            # Without the store the chat starts over rather than losing the reply;
+            # the version is unknown, so the next write is unconditional
+            print(f"State load failed for {chat_id}: {e}")
+            with self._lock:
+                entry = self._data.get(chat_id)
+            state, version = (dict(entry[1]) if entry is not None else {}), None
+        self._remember(chat_id, state, version)
+        return dict(state), version
+
+    def set(self, chat_id: str, state: Dict[str, Any], version: Optional[int] = None) -> bool:
+        """
+        Store the state over the version it was read at (None writes unconditionally);
+        False if another writer changed it since, and the caller should reload
+        """
+        try:
+            if state:
+                new_version = self.backend.save(chat_id, state, version)
+                saved = new_version is not None
+            else:
+                saved, new_version = self.backend.delete(chat_id, version), 0
+        except psycopg2.Error as e:
+            print(f"State save failed for {chat_id}: {e}")
+            self._forget(chat_id)
+            return True
+        if not saved:
+            self._forget(chat_id)
+            return False
+        self._remember(chat_id, state, new_version)
+        return True
+
+def create_state_store() -> StateStore:
+    if BOT_STATE_BACKEND == 'memory':
+        backend = MemoryStateBackend(BOT_STATE_TTL_SECONDS)
+    else:
+        backend = PostgresStateBackend(BOT_STATE_TTL_SECONDS)
+    return StateStore(backend, BOT_STATE_CACHE_MAX_SIZE, BOT_STATE_CACHE_TTL)
+
+state_store = create_state_store()
+
+def get_schedule_times(day: date) -> list:
+    """Working hours of the day: none on Tuesday and Thursday"""
+    day_of_week = day.weekday()
     
     if day_of_week in [1, 3]:
         return []
     
     if day_of_week in [5, 6]:
-        times = [f"{h}:00" for h in range(9, 20)]
-    else:
-        times = [f"{h}:00" for h in range(11, 14)] + [f"{h}:00" for h in range(17, 20)]
+        return [f"{h}:00" for h in range(9, 20)]
+    return [f"{h}:00" for h in range(11, 14)] + [f"{h}:00" for h in range(17, 20)]
+
+def get_window_availability() -> Dict[str, list]:
+    """
+    Free times for every day of the booking window, from one query over the
+    whole window; the result is shared by all updates for AVAILABILITY_CACHE_TTL
+    """
+    global _availability_cache
+    start = date.today()
+    with _availability_lock:
+        cached = _availability_cache
+        if cached and cached[0] == start and time.monotonic() - cached[1] <= AVAILABILITY_CACHE_TTL:
+            return cached[2]
+        
+        end = start + timedelta(days=BOOKING_WINDOW_DAYS - 1)
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                execute_statement(cur, 'bot_booked_times_range', (start, end))
+                booked: Dict[date, set] = {}
+                for row in cur.fetchall():
+                    booked.setdefault(row['booking_date'], set()).add(row['booking_time'])
+        finally:
+            release_db_connection(conn)
+        
+        availability = {}
+        for i in range(BOOKING_WINDOW_DAYS):
+            day = start + timedelta(days=i)
+            taken = booked.get(day, set())
+            availability[day.strftime('%Y-%m-%d')] = [t for t in get_schedule_times(day) if t not in taken]
+        _availability_cache = (start, time.monotonic(), availability)
+        return availability
+
+def invalidate_availability() -> None:
+    """Forget the shared window after this container changed a booking"""
+    global _availability_cache
+    with _availability_lock:
+        _availability_cache = None
+
+def get_available_times(date_str: str) -> list:
+    """Get available time slots for a given date based on schedule"""
+    window = get_window_availability()
+    if date_str in window:
+        return window[date_str]
+    
+    times = get_schedule_times(datetime.strptime(date_str, '%Y-%m-%d').date())
+    if not times:
+        return []
     
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT booking_time FROM t_p16986787_loft_massage_site.bookings "
-                "WHERE booking_date = %s AND status = 'active'",
-                (date_str,)
-            )
+            execute_statement(cur, 'bot_booked_times', (date_str,))
             booked = [row['booking_time'] for row in cur.fetchall()]
             return [t for t in times if t not in booked]
     finally:
-        conn.close()
+        release_db_connection(conn)
 
-def create_booking(service: str, date: str, time: str, name: str, phone: str) -> int:
-    """Create new booking in database"""
+def create_booking(service: str, date: str, time: str, name: str, phone: str) -> Optional[int]:
+    """Create new booking in database, None if the slot is already taken"""
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                "INSERT INTO t_p16986787_loft_massage_site.bookings "
-                "(service, booking_date, booking_time, customer_name, customer_phone, status) "
-                "VALUES (%s, %s, %s, %s, %s, 'active') RETURNING id",
-                (service, date, time, name, phone)
+            execute_statement(
+                cur, 'bot_create_booking',
+                (service, date, time, name, phone, SERVICE_DURATIONS.get(service, 60))
             )
-            booking_id = cur.fetchone()['id']
+            row = cur.fetchone()
             conn.commit()
+            invalidate_availability()
+            if not row:
+                return None
             
-            notify_admin(booking_id, service, date, time, name, phone)
-            return booking_id
+            # Админа уведомляет bookings-listener по ленте изменений
+            return row['id']
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def get_user_bookings(phone: str) -> list:
     """Get user's active bookings"""
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT id, service, booking_date, booking_time "
-                "FROM t_p16986787_loft_massage_site.bookings "
-                "WHERE customer_phone = %s AND status = 'active' "
-                "ORDER BY booking_date, booking_time",
-                (phone,)
-            )
+            execute_statement(cur, 'bot_user_bookings', (phone,))
             return cur.fetchall()
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def cancel_booking(booking_id: int) -> bool:
     """Cancel booking by ID"""
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                "UPDATE t_p16986787_loft_massage_site.bookings "
-                "SET status = 'cancelled' WHERE id = %s AND status = 'active'",
-                (booking_id,)
-            )
+            execute_statement(cur, 'bot_cancel_booking', (booking_id,))
             conn.commit()
+            invalidate_availability()
             return cur.rowcount > 0
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def get_all_active_bookings() -> list:
     """Get all active bookings (for admin)"""
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT id, service, booking_date, booking_time, customer_name, customer_phone "
-                "FROM t_p16986787_loft_massage_site.bookings "
-                "WHERE status = 'active' "
-                "ORDER BY booking_date, booking_time"
-            )
+            execute_statement(cur, 'bot_active_bookings')
             return cur.fetchall()
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 def is_admin(chat_id: str) -> bool:
     """Check if user is admin"""
     admin_chat_id = os.environ.get('ADMIN_CHAT_ID')
     return admin_chat_id and str(chat_id) == str(admin_chat_id)
 
-def notify_admin(booking_id: int, service: str, date: str, time: str, name: str, phone: str) -> None:
-    """Send notification to admin about new booking"""
-    admin_chat_id = os.environ.get('ADMIN_CHAT_ID')
-    if not admin_chat_id:
-        return
+def get_day_name(date_str: str) -> str:
+    """Get day name in Russian"""
+    days = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
+    return days[date_obj.weekday()]
+
+# Route result: the chat's new state and the reply, if any
+RouteResult = Tuple[Dict[str, Any], Optional[str]]
+
+def menu_keyboard(chat_id: str) -> JsonFragment:
+    return ADMIN_KEYBOARD if is_admin(chat_id) else MAIN_KEYBOARD
+
+def on_start(chat_id: str, text: str, state: Dict[str, Any]) -> RouteResult:
+    return {}, webhook_reply(chat_id, "👋 Добро пожаловать в Loft Massage!\n\nВыберите действие:", menu_keyboard(chat_id))
+
+def on_book(chat_id: str, text: str, state: Dict[str, Any]) -> RouteResult:
+    return {'step': 'choose_service'}, webhook_reply(chat_id, "Выберите тип массажа:", SERVICES_KEYBOARD)
+
+def on_my_bookings(chat_id: str, text: str, state: Dict[str, Any]) -> RouteResult:
+    return {'step': 'my_bookings'}, webhook_reply(chat_id, "Отправьте ваш номер телефона:", REMOVE_KEYBOARD)
+
+def on_admin_list(chat_id: str, text: str, state: Dict[str, Any]) -> Optional[RouteResult]:
+    if not is_admin(chat_id):
+        return None
+    bookings = get_all_active_bookings()
+    
+    if not bookings:
+        return state, webhook_reply(chat_id, "📋 Нет активных записей")
+    
+    msg = "📋 <b>Все активные записи:</b>\n\n"
+    for b in bookings:
+        msg += f"🆔 ID: <b>{b['id']}</b>\n"
+        msg += f"💆 {b['service']}\n"
+        msg += f"📅 {b['booking_date']}\n"
+        msg += f"🕐 {b['booking_time']}\n"
+        msg += f"👤 {b['customer_name']}\n"
+        msg += f"📞 {b['customer_phone']}\n\n"
+    return state, webhook_reply(chat_id, msg)
+
+def on_admin_cancel(chat_id: str, text: str, state: Dict[str, Any]) -> Optional[RouteResult]:
+    if not is_admin(chat_id):
+        return None
+    return {'step': 'admin_cancel'}, webhook_reply(chat_id, "Введите ID записи для отмены:", REMOVE_KEYBOARD)
+
+def on_choose_service(chat_id: str, text: str, state: Dict[str, Any]) -> Optional[RouteResult]:
+    if text not in SERVICE_DURATIONS:
+        return None
+    state['service'] = text
+    state['step'] = 'choose_date'
+    
+    # Only days with free time, with how many slots are left
+    keyboard_rows = []
+    for date_str, times in get_window_availability().items():
+        if times:
+            check_date = datetime.strptime(date_str, '%Y-%m-%d')
+            display = f"{get_day_name(date_str)} {check_date.strftime('%d.%m')} ({len(times)})"
+            keyboard_rows.append([{'text': display}])
+    
+    keyboard = {
+        'keyboard': keyboard_rows[:DATE_PICKER_MAX_DAYS] + [[{'text': BACK}]],
+        'resize_keyboard': True
+    }
+    if keyboard_rows:
+        return state, webhook_reply(chat_id, f"Вы выбрали: {text}\n\nВыберите дату:", keyboard)
+    return state, webhook_reply(chat_id, "К сожалению, в ближайшие две недели нет свободного времени.", keyboard)
+
+def on_choose_date(chat_id: str, text: str, state: Dict[str, Any]) -> Optional[RouteResult]:
+    try:
+        parts = text.split()
+        if len(parts) < 2:
+            return None
+        day, month = parts[1].split('.')
+        today = datetime.now()
+        date_obj = datetime(today.year, int(month), int(day))
+        # The window crosses New Year: January dates picked in December
+        if date_obj.date() < today.date():
+            date_obj = date_obj.replace(year=today.year + 1)
+    except ValueError:
+        return state, webhook_reply(chat_id, "Пожалуйста, выберите дату из предложенных вариантов")
+    date_str = date_obj.strftime('%Y-%m-%d')
+    
+    state['date'] = date_str
+    state['step'] = 'choose_time'
+    
+    available_times = get_available_times(date_str)
+    
+    if not available_times:
+        return state, webhook_reply(chat_id, "К сожалению, на эту дату нет свободных мест. Выберите другую дату.")
+    keyboard = {
+        'keyboard': [[{'text': t}] for t in available_times] + [[{'text': BACK}]],
+        'resize_keyboard': True
+    }
+    return state, webhook_reply(chat_id, "Выберите время:", keyboard)
+
+def on_choose_time(chat_id: str, text: str, state: Dict[str, Any]) -> Optional[RouteResult]:
+    if ':' not in text:
+        return None
+    state['time'] = text
+    state['step'] = 'enter_name'
+    return state, webhook_reply(chat_id, "Введите ваше имя:", REMOVE_KEYBOARD)
+
+def on_enter_name(chat_id: str, text: str, state: Dict[str, Any]) -> RouteResult:
+    state['name'] = text
+    state['step'] = 'enter_phone'
+    return state, webhook_reply(chat_id, "Введите ваш номер телефона (например: +79001234567):")
+
+def on_enter_phone(chat_id: str, text: str, state: Dict[str, Any]) -> RouteResult:
+    service = state['service']
+    date = state['date']
+    time = state['time']
+    name = state['name']
+    phone = text
+    
+    booking_id = create_booking(service, date, time, name, phone)
+    
+    if booking_id is None:
+        return {}, webhook_reply(
+            chat_id,
+            "😔 Это время уже занято. Пожалуйста, начните запись заново и выберите другое время.",
+            MAIN_KEYBOARD
+        )
     
-    message = (
-        f"🆕 <b>Новая запись!</b>\n\n"
+    return {}, webhook_reply(
+        chat_id,
+        f"✅ <b>Запись создана!</b>\n\n"
         f"📋 ID: {booking_id}\n"
         f"💆 Услуга: {service}\n"
         f"📅 Дата: {date}\n"
         f"🕐 Время: {time}\n"
-        f"👤 Клиент: {name}\n"
-        f"📞 Телефон: {phone}"
+        f"👤 Имя: {name}\n"
+        f"📞 Телефон: {phone}",
+        MAIN_KEYBOARD
     )
+
+def on_phone_for_bookings(chat_id: str, text: str, state: Dict[str, Any]) -> RouteResult:
+    bookings = get_user_bookings(text)
+    
+    if not bookings:
+        return {}, webhook_reply(chat_id, "У вас нет активных записей", BOOK_OR_BACK_KEYBOARD)
     
-    send_telegram_message(admin_chat_id, message)
+    msg = "📋 <b>Ваши записи:</b>\n\n"
+    for b in bookings:
+        msg += f"ID: {b['id']}\n"
+        msg += f"💆 {b['service']}\n"
+        msg += f"📅 {b['booking_date']}\n"
+        msg += f"🕐 {b['booking_time']}\n\n"
+    return {}, webhook_reply(chat_id, msg, BOOK_OR_BACK_KEYBOARD)
 
-def get_day_name(date_str: str) -> str:
-    """Get day name in Russian"""
-    days = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
-    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-    return days[date_obj.weekday()]
+def on_admin_cancel_id(chat_id: str, text: str, state: Dict[str, Any]) -> Optional[RouteResult]:
+    if not is_admin(chat_id):
+        return None
+    try:
+        booking_id = int(text)
+    except ValueError:
+        return {}, webhook_reply(chat_id, "❌ Пожалуйста, введите корректный ID (число)")
+    if cancel_booking(booking_id):
+        return {}, webhook_reply(chat_id, f"✅ Запись #{booking_id} успешно отменена", ADMIN_KEYBOARD)
+    return {}, webhook_reply(chat_id, f"❌ Запись #{booking_id} не найдена или уже отменена")
+
+# Menu buttons and commands work from any step; a route returning None
+# (e.g. an admin button pressed by a client) falls through to the step route
+COMMAND_ROUTES: Dict[str, Callable[[str, str, Dict[str, Any]], Optional[RouteResult]]] = {
+    '/start': on_start,
+    BACK: on_start,
+    BOOK: on_book,
+    MY_BOOKINGS: on_my_bookings,
+    ADMIN_LIST: on_admin_list,
+    ADMIN_CANCEL: on_admin_cancel,
+}
+
+# Free text is routed by the conversation step
+STEP_ROUTES: Dict[str, Callable[[str, str, Dict[str, Any]], Optional[RouteResult]]] = {
+    'choose_service': on_choose_service,
+    'choose_date': on_choose_date,
+    'choose_time': on_choose_time,
+    'enter_name': on_enter_name,
+    'enter_phone': on_enter_phone,
+    'my_bookings': on_phone_for_bookings,
+    'admin_cancel': on_admin_cancel_id,
+}
+
+def route_message(chat_id: str, text: str, state: Dict[str, Any]) -> RouteResult:
+    """New state and reply for a message; unknown input keeps the state and gets no reply"""
+    command = COMMAND_ROUTES.get(text)
+    if command is not None:
+        result = command(chat_id, text, state)
+        if result is not None:
+            return result
+    step = STEP_ROUTES.get(state.get('step'))
+    if step is not None:
+        result = step(chat_id, text, state)
+        if result is not None:
+            return result
+    return state, None
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -200,252 +782,35 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         update = json.loads(event.get('body', '{}'))
         
         if 'message' not in update:
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'ok': True})
-            }
+            return webhook_response()
         
         message = update['message']
         chat_id = str(message['chat']['id'])
         text = message.get('text', '')
         
-        if chat_id not in user_states:
-            user_states[chat_id] = {}
-        
-        state = user_states[chat_id]
-        
-        if text == '/start' or text == '↩️ Назад':
-            user_states[chat_id] = {}
-            
-            if is_admin(chat_id):
-                keyboard = {
-                    'keyboard': [
-                        [{'text': '📅 Записаться на массаж'}],
-                        [{'text': '📋 Мои записи'}],
-                        [{'text': '⚙️ Все записи (админ)'}, {'text': '❌ Отменить запись'}]
-                    ],
-                    'resize_keyboard': True
-                }
-            else:
-                keyboard = {
-                    'keyboard': [
-                        [{'text': '📅 Записаться на массаж'}],
-                        [{'text': '📋 Мои записи'}]
-                    ],
-                    'resize_keyboard': True
-                }
-            
-            send_telegram_message(
-                chat_id,
-                "👋 Добро пожаловать в Loft Massage!\n\nВыберите действие:",
-                keyboard
-            )
-        
-        elif text == '📅 Записаться на массаж':
-            user_states[chat_id] = {'step': 'choose_service'}
-            keyboard = {
-                'keyboard': [
-                    [{'text': 'Классический массаж спина'}],
-                    [{'text': 'Успокаивающий массаж спина'}],
-                    [{'text': 'Классический массаж тело'}],
-                    [{'text': 'Расслабляющий массаж тела'}],
-                    [{'text': '↩️ Назад'}]
-                ],
-                'resize_keyboard': True
-            }
-            send_telegram_message(chat_id, "Выберите тип массажа:", keyboard)
-        
-        elif state.get('step') == 'choose_service' and text in [
-            'Классический массаж спина', 
-            'Успокаивающий массаж спина', 
-            'Классический массаж тело', 
-            'Расслабляющий массаж тела'
-        ]:
-            user_states[chat_id]['service'] = text
-            user_states[chat_id]['step'] = 'choose_date'
-            
-            today = datetime.now()
-            dates = []
-            keyboard_rows = []
-            
-            for i in range(14):
-                check_date = today + timedelta(days=i)
-                date_str = check_date.strftime('%Y-%m-%d')
-                day_name = get_day_name(date_str)
-                
-                if check_date.weekday() not in [1, 3]:
-                    display = f"{day_name} {check_date.strftime('%d.%m')}"
-                    dates.append(date_str)
-                    keyboard_rows.append([{'text': display, 'callback_data': date_str}])
-            
-            keyboard = {
-                'keyboard': keyboard_rows[:7] + [[{'text': '↩️ Назад'}]],
-                'resize_keyboard': True
-            }
-            send_telegram_message(chat_id, f"Вы выбрали: {text}\n\nВыберите дату:", keyboard)
-        
-        elif state.get('step') == 'choose_date':
-            try:
-                parts = text.split()
-                if len(parts) >= 2:
-                    date_part = parts[1]
-                    day, month = date_part.split('.')
-                    year = datetime.now().year
-                    date_obj = datetime(year, int(month), int(day))
-                    date_str = date_obj.strftime('%Y-%m-%d')
-                    
-                    user_states[chat_id]['date'] = date_str
-                    user_states[chat_id]['step'] = 'choose_time'
-                    
-                    available_times = get_available_times(date_str)
-                    
-                    if not available_times:
-                        send_telegram_message(chat_id, "К сожалению, на эту дату нет свободных мест. Выберите другую дату.")
-                    else:
-                        keyboard = {
-                            'keyboard': [[{'text': t}] for t in available_times] + [[{'text': '↩️ Назад'}]],
-                            'resize_keyboard': True
-                        }
-                        send_telegram_message(chat_id, "Выберите время:", keyboard)
-            except:
-                send_telegram_message(chat_id, "Пожалуйста, выберите дату из предложенных вариантов")
-        
-        elif state.get('step') == 'choose_time' and ':' in text:
-            user_states[chat_id]['time'] = text
-            user_states[chat_id]['step'] = 'enter_name'
-            
-            keyboard = {'remove_keyboard': True}
-            send_telegram_message(chat_id, "Введите ваше имя:", keyboard)
-        
-        elif state.get('step') == 'enter_name':
-            user_states[chat_id]['name'] = text
-            user_states[chat_id]['step'] = 'enter_phone'
-            send_telegram_message(chat_id, "Введите ваш номер телефона (например: +79001234567):")
-        
-        elif state.get('step') == 'enter_phone':
-            user_states[chat_id]['phone'] = text
-            
-            service = state['service']
-            date = state['date']
-            time = state['time']
-            name = state['name']
-            phone = text
-            
-            booking_id = create_booking(service, date, time, name, phone)
-            
-            keyboard = {
-                'keyboard': [
-                    [{'text': '📅 Записаться на массаж'}],
-                    [{'text': '📋 Мои записи'}]
-                ],
-                'resize_keyboard': True
-            }
-            
-            send_telegram_message(
-                chat_id,
-                f"✅ <b>Запись создана!</b>\n\n"
-                f"📋 ID: {booking_id}\n"
-                f"💆 Услуга: {service}\n"
-                f"📅 Дата: {date}\n"
-                f"🕐 Время: {time}\n"
-                f"👤 Имя: {name}\n"
-                f"📞 Телефон: {phone}",
-                keyboard
-            )
-            
-            user_states[chat_id] = {}
-        
-        elif text == '📋 Мои записи':
-            user_states[chat_id] = {'step': 'my_bookings'}
-            keyboard = {'remove_keyboard': True}
-            send_telegram_message(chat_id, "Отправьте ваш номер телефона:", keyboard)
-        
-        elif state.get('step') == 'my_bookings':
-            bookings = get_user_bookings(text)
-            
-            if not bookings:
-                keyboard = {
-                    'keyboard': [
-                        [{'text': '📅 Записаться на массаж'}],
-                        [{'text': '↩️ Назад'}]
-                    ],
-                    'resize_keyboard': True
-                }
-                send_telegram_message(chat_id, "У вас нет активных записей", keyboard)
-            else:
-                msg = "📋 <b>Ваши записи:</b>\n\n"
-                for b in bookings:
-                    msg += f"ID: {b['id']}\n"
-                    msg += f"💆 {b['service']}\n"
-                    msg += f"📅 {b['booking_date']}\n"
-                    msg += f"🕐 {b['booking_time']}\n\n"
-                
-                keyboard = {
-                    'keyboard': [
-                        [{'text': '📅 Записаться на массаж'}],
-                        [{'text': '↩️ Назад'}]
-                    ],
-                    'resize_keyboard': True
-                }
-                send_telegram_message(chat_id, msg, keyboard)
-            
-            user_states[chat_id] = {}
-        
-        elif text == '⚙️ Все записи (админ)' and is_admin(chat_id):
-            bookings = get_all_active_bookings()
-            
-            if not bookings:
-                send_telegram_message(chat_id, "📋 Нет активных записей")
-            else:
-                msg = "📋 <b>Все активные записи:</b>\n\n"
-                for b in bookings:
-                    msg += f"🆔 ID: <b>{b['id']}</b>\n"
-                    msg += f"💆 {b['service']}\n"
-                    msg += f"📅 {b['booking_date']}\n"
-                    msg += f"🕐 {b['booking_time']}\n"
-                    msg += f"👤 {b['customer_name']}\n"
-                    msg += f"📞 {b['customer_phone']}\n\n"
-                
-                send_telegram_message(chat_id, msg)
-        
-        elif text == '❌ Отменить запись' and is_admin(chat_id):
-            user_states[chat_id] = {'step': 'admin_cancel'}
-            keyboard = {'remove_keyboard': True}
-            send_telegram_message(chat_id, "Введите ID записи для отмены:", keyboard)
-        
-        elif state.get('step') == 'admin_cancel' and is_admin(chat_id):
-            try:
-                booking_id = int(text)
-                if cancel_booking(booking_id):
-                    keyboard = {
-                        'keyboard': [
-                            [{'text': '📅 Записаться на массаж'}],
-                            [{'text': '📋 Мои записи'}],
-                            [{'text': '⚙️ Все записи (админ)'}, {'text': '❌ Отменить запись'}]
-                        ],
-                        'resize_keyboard': True
-                    }
-                    send_telegram_message(chat_id, f"✅ Запись #{booking_id} успешно отменена", keyboard)
-                else:
-                    send_telegram_message(chat_id, f"❌ Запись #{booking_id} не найдена или уже отменена")
-            except ValueError:
-                send_telegram_message(chat_id, "❌ Пожалуйста, введите корректный ID (число)")
-            
-            user_states[chat_id] = {}
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'ok': True})
-        }
+        state, version = state_store.get(chat_id)
+        for _ in range(BOT_STATE_MAX_REROUTES):
+            if state.get('step') in BOOKING_WRITE_STEPS:
+                # The booking write is not repeatable: the step is taken first by
+                # ending the conversation over the version read, so a stale or
+                # concurrent copy of the state never reaches the write
+                if not state_store.set(chat_id, {}, version):
+                    state, version = state_store.reload(chat_id)
+                    continue
+                new_state, reply = route_message(chat_id, text, state)
+                # The write has happened: never routed again, whatever the save says
+                if new_state:
+                    state_store.set(chat_id, new_state, 0)
+                break
+            new_state, reply = route_message(chat_id, text, state)
+            if state_store.set(chat_id, new_state, version):
+                break
+            # Another container moved this chat on meanwhile: route against its state
+            state, version = state_store.reload(chat_id)
+        else:
+            print(f"State of {chat_id} kept changing; not replying")
+            reply = None
+        return webhook_response(reply)
         
     except Exception as e:
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'ok': True})
-        }
\ No newline at end of file
+        return webhook_response()
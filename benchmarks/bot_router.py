@@ -0,0 +1,161 @@
+"""
+Business: Стоимость маршрутизации одного обновления в вебхуке телеграм-бота
+Args: --iterations вызовов на сценарий, --rounds повторов, --before ревизия git для сравнения
+Returns: процессорное время и пик выделенной памяти на обновление по сценариям
+
+Сценарии не обращаются к БД и Telegram: состояние диалога хранится в памяти
+(BOT_STATE_BACKEND=memory) и выставляется перед каждым вызовом вне замера.
+С --before тот же набор прогоняется на backend/telegram-bot/index.py из
+указанной ревизии; версии чередуются по раундам, берётся лучший раунд.
+Старые ревизии отвечали исходящим запросом sendMessage и без
+TELEGRAM_BOT_TOKEN не кодировали ответ вовсе, поэтому токен задаётся
+фиктивный, а urlopen заменяется пустышкой: сообщение собирается и
+кодируется, но не отправляется. Сравнивать имеет смысл с ревизией до
+переделки маршрутизатора, а не с соседним коммитом:
+    python benchmarks/bot_router.py --iterations 20000 --before 047f406
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from typing import Any, Dict, List, Tuple
+
+from common import ROOT, load_handler
+
+CLIENT_CHAT = 1001
+ADMIN_CHAT = 1
+
+BOOKING_STATE = {'service': 'Классический массаж тело', 'date': '2026-11-21'}
+
+# Название, чат, состояние перед вызовом, текст сообщения
+SCENARIOS: List[Tuple[str, int, Dict[str, Any], str]] = [
+    ('start', CLIENT_CHAT, {}, '/start'),
+    ('start (admin)', ADMIN_CHAT, {}, '/start'),
+    ('back', CLIENT_CHAT, {'step': 'choose_service'}, '↩️ Назад'),
+    ('book', CLIENT_CHAT, {}, '📅 Записаться на массаж'),
+    ('my bookings', CLIENT_CHAT, {}, '📋 Мои записи'),
+    ('admin cancel', ADMIN_CHAT, {}, '❌ Отменить запись'),
+    ('choose time', CLIENT_CHAT, {**BOOKING_STATE, 'step': 'choose_time'}, '12:00'),
+    ('enter name', CLIENT_CHAT, {**BOOKING_STATE, 'time': '12:00', 'step': 'enter_name'}, 'Анна'),
+    ('unknown text', CLIENT_CHAT, {}, 'привет'),
+]
+
+
+def load_revision(revision: str):
+    """backend/telegram-bot/index.py as of a git revision"""
+    source = subprocess.run(
+        ['git', 'show', f'{revision}:backend/telegram-bot/index.py'],
+        cwd=ROOT, capture_output=True, check=True
+    ).stdout
+    with tempfile.NamedTemporaryFile('wb', suffix='.py', delete=False) as f:
+        f.write(source)
+    spec = importlib.util.spec_from_file_location(f'telegram_bot_{revision.replace("~", "_")}', f.name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    os.unlink(f.name)
+    return module
+
+
+def set_state(bot, chat_id: int, state: Dict[str, Any]) -> None:
+    if hasattr(bot, 'state_store'):
+        bot.state_store.set(str(chat_id), dict(state))
+    else:
+        bot.user_states[str(chat_id)] = dict(state)
+
+
+def run(bot, iterations: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, chat_id, state, text in SCENARIOS:
+        event = {
+            'httpMethod': 'POST',
+            'body': json.dumps({'message': {'chat': {'id': chat_id}, 'text': text}}, ensure_ascii=False),
+        }
+        for _ in range(min(iterations, 200)):
+            set_state(bot, chat_id, state)
+            bot.handler(dict(event), None)
+
+        cpu = []
+        for _ in range(iterations):
+            set_state(bot, chat_id, state)
+            started = time.process_time_ns()
+            bot.handler(dict(event), None)
+            cpu.append(time.process_time_ns() - started)
+
+        # Отдельный проход: tracemalloc сам замедляет вызовы
+        tracemalloc.start()
+        peaks = []
+        for _ in range(min(iterations, 1000)):
+            set_state(bot, chat_id, state)
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            bot.handler(dict(event), None)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+
+        results[name] = {
+            'cpu_us': statistics.median(cpu) / 1000,
+            'cpu_mean_us': statistics.fmean(cpu) / 1000,
+            'peak_kib': statistics.median(peaks) / 1024,
+        }
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--before', help='ревизия git для сравнения, например 047f406')
+    args = parser.parse_args()
+
+    os.environ['BOT_STATE_BACKEND'] = 'memory'
+    os.environ['ADMIN_CHAT_ID'] = str(ADMIN_CHAT)
+    # Бенчмарк не должен ходить в Telegram, но ответ старой ревизии должен
+    # закодироваться так же, как в бою
+    os.environ['TELEGRAM_BOT_TOKEN'] = 'bench'
+    urllib.request.urlopen = lambda request, *args, **kwargs: None
+
+    bots = {'after': load_handler('telegram-bot')}
+    if args.before:
+        bots['before'] = load_revision(args.before)
+    best: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for _ in range(args.rounds):
+        for label, bot in bots.items():
+            result = run(bot, args.iterations)
+            previous = best.setdefault(label, result)
+            for name, row in result.items():
+                for key, value in row.items():
+                    previous[name][key] = min(previous[name][key], value)
+    after = best['after']
+    before = best.get('before')
+
+    width = max(len(name) for name, *_ in SCENARIOS)
+    if before is None:
+        print(f"{'scenario':<{width}}  {'cpu us':>8}  {'mean us':>8}  {'peak KiB':>9}")
+        for name, row in after.items():
+            print(f"{name:<{width}}  {row['cpu_us']:>8.1f}  {row['cpu_mean_us']:>8.1f}  {row['peak_kib']:>9.1f}")
+        return 0
+
+    print(f"before: {args.before}, after: working tree, {args.iterations} updates per scenario\n")
+    print(f"{'scenario':<{width}}  {'cpu us':>8}  {'now us':>8}  {'delta':>7}  {'peak KiB':>9}  {'now KiB':>8}")
+    for name, row in after.items():
+        old = before[name]
+        delta = (row['cpu_us'] - old['cpu_us']) / old['cpu_us'] * 100 if old['cpu_us'] else 0.0
+        print(f"{name:<{width}}  {old['cpu_us']:>8.1f}  {row['cpu_us']:>8.1f}  {delta:>+6.1f}%  "
+              f"{old['peak_kib']:>9.1f}  {row['peak_kib']:>8.1f}")
+    total_before = sum(r['cpu_mean_us'] for r in before.values())
+    total_after = sum(r['cpu_mean_us'] for r in after.values())
+    print(f"\nmean per update over all scenarios: {total_before / len(before):.1f} us -> "
+          f"{total_after / len(after):.1f} us ({(total_after - total_before) / total_before * 100:+.1f}%)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
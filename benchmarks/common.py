@@ -0,0 +1,43 @@
+"""
+Business: Общие помощники для локальных бенчмарков бэкенда
+Args: пути к функциям backend/* и миграциям db_migrations
+Returns: загруженные модули handler и применённые миграции
+"""
+
+import importlib.util
+import re
+from pathlib import Path
+from typing import List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+MIGRATIONS_DIR = ROOT / 'db_migrations'
+
+
+def load_handler(function_name: str):
+    """Load backend/<function_name>/index.py under a unique module name"""
+    path = ROOT / 'backend' / function_name / 'index.py'
+    spec = importlib.util.spec_from_file_location(f'{function_name.replace("-", "_")}_index', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def migration_version(path: Path) -> int:
+    match = re.match(r'V(\d+)__', path.name)
+    if not match:
+        raise ValueError(f'Not a migration file: {path.name}')
+    return int(match.group(1))
+
+
+def list_migrations(start: int = 1, stop: Optional[int] = None) -> List[Path]:
+    """Migration files with start <= version < stop, in version order"""
+    files = sorted(MIGRATIONS_DIR.glob('V*__*.sql'), key=migration_version)
+    return [f for f in files if migration_version(f) >= start and (stop is None or migration_version(f) < stop)]
+
+
+def apply_migrations(conn, files: List[Path]) -> None:
+    """Apply migration files in order, each in its own transaction"""
+    for path in files:
+        with conn.cursor() as cur:
+            cur.execute(path.read_text(encoding='utf-8'))
+        conn.commit()
@@ -0,0 +1,86 @@
+"""
+Business: Нагрузочная проверка атомарного бронирования слота
+Args: --requests N параллельных POST на один и тот же слот, --threads число потоков
+Returns: пропускная способность и проверка, что успешна ровно одна запись
+
+Запуск против локальной БД с применёнными db_migrations:
+    DATABASE_URL=postgresql://localhost/loft python benchmarks/concurrent_booking.py --requests 200 --threads 32
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from common import load_handler
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--date', default='2099-01-05', help='дата слота, по умолчанию далеко в будущем')
+    parser.add_argument('--time', default='12:00')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        print('DATABASE_URL не задан', file=sys.stderr)
+        return 2
+
+    # Пул должен выдержать все потоки, иначе измеряем ожидание пула
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.threads))
+    bookings = load_handler('bookings')
+
+    # Уникальное имя, чтобы отличить записи этого прогона
+    run_id = uuid.uuid4().hex[:8]
+    barrier = threading.Barrier(min(args.threads, args.requests))
+
+    def fire(i: int) -> int:
+        event = {
+            'httpMethod': 'POST',
+            'body': json.dumps({
+                'service': 'Классический массаж спина',
+                'booking_date': args.date,
+                'booking_time': args.time,
+                'customer_name': f'bench-{run_id}-{i}',
+                'customer_phone': '+70000000000',
+            }),
+        }
+        if i < barrier.parties:
+            barrier.wait()
+        return bookings.handler(event, None)['statusCode']
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        statuses = Counter(pool.map(fire, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    print(f'requests:   {args.requests} ({args.threads} threads)')
+    print(f'elapsed:    {elapsed:.3f}s')
+    print(f'throughput: {args.requests / elapsed:.1f} req/s')
+    print(f'statuses:   {dict(sorted(statuses.items()))}')
+
+    # Убираем за собой созданную запись, чтобы прогон можно было повторить
+    conn = bookings.get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM bookings WHERE customer_name LIKE %s",
+                (f'bench-{run_id}-%',)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+    ok = statuses.get(201, 0) == 1 and statuses.get(409, 0) == args.requests - 1
+    print('result:     OK' if ok else 'result:     FAIL — ожидалась ровно одна 201, остальные 409')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
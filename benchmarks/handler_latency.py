@@ -0,0 +1,248 @@
+"""
+Business: Замер задержки обработчиков на сценариях из tests.json
+Args: --requests вызовов на сценарий, --concurrency число потоков, --baseline/--compare файлы JSON
+Returns: p50/p95/p99 и пропускная способность по сценариям и HTTP-методам
+
+Сценарии берутся из backend/*/tests.json, handler(event, context) вызывается
+напрямую против локальной БД с применёнными db_migrations. POST функции bookings
+на каждый вызов получает свой свободный слот (иначе все вызовы после первого
+замеряют ответ 409), созданные записи удаляются после прогона:
+    DATABASE_URL=postgresql://localhost/loft python benchmarks/handler_latency.py \\
+        --requests 2000 --concurrency 8 --baseline bench/baseline.json
+    DATABASE_URL=... python benchmarks/handler_latency.py --compare bench/baseline.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+from common import ROOT, load_handler
+
+FUNCTIONS = ('bookings', 'telegram-bot')
+# Слоты для создаваемых записей: далеко в будущем, по часу на запись
+BENCH_SLOT_START = date(2099, 1, 1)
+
+Event = Dict[str, Any]
+
+
+class SlotAllocator:
+    """Hands out booking slots nobody has taken, tagged with the run id for cleanup"""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def fill(self, item: Any) -> Any:
+        if not isinstance(item, dict):
+            return item
+        with self._lock:
+            n = self._next
+            self._next += 1
+        return {
+            **item,
+            'booking_date': (BENCH_SLOT_START + timedelta(days=n // 24)).isoformat(),
+            'booking_time': f'{n % 24:02d}:00',
+            'customer_name': f'bench-{self.run_id}-{n}',
+        }
+
+    def fresh_event(self, event: Event) -> Event:
+        """Copy of a booking POST whose bookings take new slots"""
+        body = json.loads(event['body'])
+        body = [self.fill(item) for item in body] if isinstance(body, list) else self.fill(body)
+        return {**event, 'body': json.dumps(body, ensure_ascii=False)}
+
+    def cleanup(self, bookings) -> int:
+        """Delete the bookings this run created; returns their count"""
+        conn = bookings.get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM bookings WHERE booking_date >= %s AND customer_name LIKE %s",
+                    (BENCH_SLOT_START, f'bench-{self.run_id}-%')
+                )
+                deleted = cur.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return deleted
+
+
+def build_event(test: Dict[str, Any]) -> Event:
+    """Turn a tests.json case into the event the platform passes to handler"""
+    url = urlsplit(test.get('path', '/'))
+    event: Event = {
+        'httpMethod': test.get('method', 'GET'),
+        'path': url.path or '/',
+        'headers': dict(test.get('headers', {})),
+        'queryStringParameters': dict(parse_qsl(url.query)) or None,
+    }
+    body = test.get('body')
+    if body is not None:
+        event['body'] = body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)
+    return event
+
+
+def load_scenarios(functions: List[str]) -> List[Dict[str, Any]]:
+    scenarios = []
+    for function_name in functions:
+        with open(ROOT / 'backend' / function_name / 'tests.json', encoding='utf-8') as f:
+            tests = json.load(f)['tests']
+        for test in tests:
+            scenarios.append({
+                'function': function_name,
+                'name': test['name'],
+                'method': test.get('method', 'GET'),
+                'event': build_event(test),
+                'creates_bookings': function_name == 'bookings' and test.get('method') == 'POST' and 'body' in test,
+            })
+    return scenarios
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': values[-1] * 1000 if values else 0.0,
+        'rps': len(values) / elapsed if elapsed else 0.0,
+    }
+
+
+def run_scenario(handler, event: Event, requests: int, concurrency: int, warmup: int,
+                 prepare: Callable[[Event], Event] = dict) -> Dict[str, Any]:
+    for _ in range(warmup):
+        handler(prepare(event), None)
+
+    def call(_: int):
+        request = prepare(event)
+        started = time.perf_counter()
+        response = handler(request, None)
+        return time.perf_counter() - started, response['statusCode']
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    summary = summarize([latency for latency, _ in results], elapsed)
+    summary['statuses'] = {str(k): v for k, v in sorted(Counter(s for _, s in results).items())}
+    summary['_latencies'] = [latency for latency, _ in results]
+    summary['_elapsed'] = elapsed
+    return summary
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(title: str, rows: Dict[str, Dict[str, Any]], previous: Optional[Dict[str, Dict[str, Any]]]) -> None:
+    width = max([len(title)] + [len(key) for key in rows])
+    print(f"{title:<{width}}  {'p50 ms':>9}  {'p95 ms':>9}  {'p99 ms':>9}  {'req/s':>9}")
+    for key, row in rows.items():
+        line = f"{key:<{width}}  {row['p50_ms']:>9.3f}  {row['p95_ms']:>9.3f}  {row['p99_ms']:>9.3f}  {row['rps']:>9.1f}"
+        old = (previous or {}).get(key)
+        if old:
+            delta = (row['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0.0
+            line += f"  p95 {delta:+.1f}%"
+        print(line)
+    print()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='вызовов на сценарий')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--function', action='append', choices=FUNCTIONS, help='по умолчанию все функции')
+    parser.add_argument('--baseline', help='записать результаты в JSON-файл')
+    parser.add_argument('--compare', help='сравнить с ранее записанным JSON-файлом')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        print('DATABASE_URL не задан', file=sys.stderr)
+        return 2
+    # Бенчмарк не должен ходить в Telegram
+    os.environ.pop('TELEGRAM_BOT_TOKEN', None)
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.concurrency))
+
+    functions = args.function or list(FUNCTIONS)
+    modules = {name: load_handler(name) for name in functions}
+    slots = SlotAllocator(uuid.uuid4().hex[:8])
+
+    scenarios: Dict[str, Dict[str, Any]] = {}
+    try:
+        for scenario in load_scenarios(functions):
+            key = f"{scenario['function']}: {scenario['name']}"
+            prepare = slots.fresh_event if scenario['creates_bookings'] else dict
+            result = run_scenario(modules[scenario['function']].handler, scenario['event'],
+                                  args.requests, args.concurrency, args.warmup, prepare)
+            result['method'] = scenario['method']
+            scenarios[key] = result
+    finally:
+        if 'bookings' in modules:
+            print(f"removed {slots.cleanup(modules['bookings'])} bookings created by the run\n")
+
+    by_method: Dict[str, Dict[str, Any]] = {}
+    for method in sorted({s['method'] for s in scenarios.values()}):
+        runs = [s for s in scenarios.values() if s['method'] == method]
+        latencies = [latency for s in runs for latency in s['_latencies']]
+        by_method[method] = summarize(latencies, sum(s['_elapsed'] for s in runs))
+
+    for result in scenarios.values():
+        del result['_latencies'], result['_elapsed']
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        print(f"compared with {args.compare} (revision {previous.get('revision')})\n")
+
+    print_table('scenario', scenarios, previous and previous.get('scenarios'))
+    print_table('method', by_method, previous and previous.get('methods'))
+    for key, result in scenarios.items():
+        print(f"{key}: statuses {result['statuses']}")
+
+    if args.baseline:
+        report = {
+            'revision': git_revision(),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'scenarios': scenarios,
+            'methods': by_method,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'\nbaseline written to {args.baseline}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Business: Выигрыш от серверных подготовленных операторов на смеси запросов обработчика
+Args: --iterations запросов смеси в каждом режиме, --plan-cache-mode режим кэша планов PostgreSQL
+Returns: время планирования и выполнения каждого оператора обычным запросом и через EXECUTE
+
+Операторы берутся из STATEMENTS обработчика bookings и выполняются через его
+PreparedStatements, включённый и выключенный, каждый режим на своём соединении.
+Все изменения делаются в одной транзакции и в конце откатываются:
+    DATABASE_URL=postgresql://localhost/loft python benchmarks/prepared_statements.py --iterations 5000
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import re
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+import psycopg2
+
+from common import load_handler
+
+# Доля оператора в смеси запросов: чтение слотов и ETag преобладают,
+# создание и отмена — меньшинство
+MIX: List[Tuple[str, int]] = [
+    ('booked_times', 40),
+    ('etag_by_date', 10),
+    ('bookings_by_date', 10),
+    ('etag_active_list', 8),
+    ('booking_by_token_and_date', 8),
+    ('create_booking', 12),
+    ('idempotent_booking', 4),
+    ('cancel_by_token_and_date', 4),
+    ('cancel_by_id_and_date', 4),
+]
+
+PLANNING_TIME_RE = re.compile(r'Planning Time: ([0-9.]+) ms')
+
+
+def build_args(sample: Dict[str, Any]) -> Dict[str, Callable[[int], tuple]]:
+    """Arguments for each statement; i varies the slot so inserts do not all conflict"""
+    day = sample['day']
+    return {
+        'booked_times': lambda i: ([day + timedelta(days=d) for d in range(31)],),
+        'etag_by_date': lambda i: (day,),
+        'bookings_by_date': lambda i: (day,),
+        'etag_active_list': lambda i: (),
+        'booking_by_token_and_date': lambda i: (sample['token_hash'], day),
+        'create_booking': lambda i: (
+            'Классический массаж тело', day + timedelta(days=i % 300), f'{9 + i % 11}:00',
+            'bench', '+70000000000', hashlib.sha256(f'bench-{i}'.encode()).digest(), 60,
+            hashlib.sha256(f'key-{i}'.encode()).digest(), hashlib.sha256(f'body-{i}'.encode()).digest(), 24
+        ),
+        'idempotent_booking': lambda i: (sample['key_hash'], 24),
+        'cancel_by_token_and_date': lambda i: (sample['token_hash'], day),
+        'cancel_by_id_and_date': lambda i: (sample['id'], day),
+    }
+
+
+def seed(conn) -> Dict[str, Any]:
+    """One booking with an idempotency key, inside the benchmark transaction"""
+    day = date.today() + timedelta(days=400)
+    token_hash = hashlib.sha256(b'bench-token').digest()
+    key_hash = hashlib.sha256(b'bench-key').digest()
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO bookings (service, booking_date, booking_time, customer_name, customer_phone, "
+            "cancel_token_hash, duration_minutes) VALUES ('Классический массаж спина', %s, '8:00', "
+            "'bench', '+70000000000', %s, 30) RETURNING id",
+            (day, token_hash)
+        )
+        booking_id = cur.fetchone()[0]
+        cur.execute(
+            "INSERT INTO booking_idempotency_keys (key_hash, booking_id, booking_date) VALUES (%s, %s, %s)",
+            (key_hash, booking_id, day)
+        )
+    return {'id': booking_id, 'day': day, 'token_hash': token_hash, 'key_hash': key_hash}
+
+
+def planning_ms(cur, sql: str, args) -> float:
+    cur.execute('EXPLAIN (SUMMARY ON) ' + sql, args)
+    for (line,) in cur.fetchall():
+        match = PLANNING_TIME_RE.search(line)
+        if match:
+            return float(match.group(1))
+    return 0.0
+
+
+def run_mode(bookings, prepared: bool, iterations: int, plan_cache_mode: str) -> Dict[str, Dict[str, float]]:
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    registry = bookings.PreparedStatements(bookings.STATEMENTS, prepared)
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SET plan_cache_mode = %s', (plan_cache_mode,))
+        sample = seed(conn)
+        args_for = build_args(sample)
+        names = [name for name, _ in MIX]
+        weights = [weight for _, weight in MIX]
+        rng = random.Random(42)
+
+        timings: Dict[str, List[float]] = {name: [] for name in names}
+        with conn.cursor() as cur:
+            for i in range(iterations):
+                name = rng.choices(names, weights)[0]
+                started = time.perf_counter()
+                registry.execute(conn, cur, name, args_for[name](i))
+                cur.fetchall()
+                timings[name].append(time.perf_counter() - started)
+
+            results = {}
+            for name in names:
+                args = args_for[name](0)
+                if prepared:
+                    # План уже в кэше соединения: EXPLAIN EXECUTE показывает
+                    # стоимость его получения
+                    sql = f"EXECUTE {name}" + (f"({', '.join(['%s'] * len(args))})" if args else '')
+                    plan = planning_ms(cur, sql, args)
+                else:
+                    sql = re.sub(r'\$(\d+)', r'%(p\1)s', bookings.STATEMENTS[name][1])
+                    plan = planning_ms(cur, sql, {f'p{i}': value for i, value in enumerate(args, 1)})
+                values = timings[name]
+                results[name] = {
+                    'count': len(values),
+                    'exec_us': statistics.median(values) * 1e6 if values else 0.0,
+                    'total_ms': sum(values) * 1000,
+                    'plan_ms': plan,
+                }
+        return results
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5000)
+    parser.add_argument('--plan-cache-mode', default='force_generic_plan', help='как DB_PLAN_CACHE_MODE обработчика',
+                        choices=('auto', 'force_generic_plan', 'force_custom_plan'))
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        print('DATABASE_URL не задан', file=sys.stderr)
+        return 2
+    os.environ['REQUEST_TIMING'] = '0'
+    bookings = load_handler('bookings')
+
+    # Прогрев кэшей БД, чтобы первый режим не платил за холодный старт
+    run_mode(bookings, False, max(args.iterations // 5, 1), args.plan_cache_mode)
+    plain = run_mode(bookings, False, args.iterations, args.plan_cache_mode)
+    prepared = run_mode(bookings, True, args.iterations, args.plan_cache_mode)
+
+    width = max(len(name) for name, _ in MIX)
+    print(f"{'statement':<{width}}  {'n':>5}  {'plan ms':>8}  {'prep plan':>9}  {'exec us':>8}  {'prep us':>8}  {'delta':>7}")
+    for name, _ in MIX:
+        a, b = plain[name], prepared[name]
+        delta = (b['exec_us'] - a['exec_us']) / a['exec_us'] * 100 if a['exec_us'] else 0.0
+        print(f"{name:<{width}}  {a['count']:>5}  {a['plan_ms']:>8.3f}  {b['plan_ms']:>9.3f}  "
+              f"{a['exec_us']:>8.1f}  {b['exec_us']:>8.1f}  {delta:>+6.1f}%")
+
+    total_plain = sum(r['total_ms'] for r in plain.values())
+    total_prepared = sum(r['total_ms'] for r in prepared.values())
+    print(f"\nmix of {args.iterations} queries (plan_cache_mode={args.plan_cache_mode}): "
+          f"plain {total_plain:.1f} ms, prepared {total_prepared:.1f} ms, "
+          f"{(total_prepared - total_plain) / total_plain * 100:+.1f}%")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""
+Business: Замороженная проверка миграции V0004: планы запросов до и после неё
+Args: --rows число исторических записей для наполнения, --runs повторов каждого запроса
+Returns: таблица медианного времени EXPLAIN ANALYZE для каждого запроса и тип плана
+
+Это снимок на момент V0004, а не проверка текущих обработчиков. Схема
+поднимается только до V0004 (cancel_token открытым текстом, без секций),
+и запросы в QUERIES_V0004 записаны так, как обработчики отправляли их
+тогда: SELECT *, поиск по cancel_token, без условия booking_date >=
+CURRENT_DATE. Со схемой V0006+ они не выполнятся, а обработчиков больше не
+описывают. Текущие запросы из STATEMENTS обработчика bookings измеряет
+benchmarks/prepared_statements.py.
+
+Нужна пустая локальная БД — скрипт сам применяет миграции:
+    DATABASE_URL=postgresql://localhost/loft_bench python benchmarks/query_plans.py --rows 1000000
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+
+import psycopg2
+
+from common import apply_migrations, list_migrations, migration_version, MIGRATIONS_DIR
+
+INDEX_MIGRATION = 'V0004__tune_booking_indexes.sql'
+
+# Сколько разных часов в день занимают исторические записи (9:00-19:00)
+SLOTS_PER_DAY = 11
+
+# Запросы обоих обработчиков в том виде, в каком они уходили в БД во
+# времена V0004. Не обновлять вслед за обработчиками: это снимок
+QUERIES_V0004: List[Tuple[str, str]] = [
+    ('bookings: GET ?token=',
+     "SELECT * FROM bookings WHERE cancel_token = %(token)s"),
+    ('bookings: GET ?date= etag',
+     "SELECT count(*) AS cnt, max(updated_at) AS ts FROM bookings WHERE booking_date = %(date)s"),
+    ('bookings: GET ?date=',
+     "SELECT * FROM bookings WHERE booking_date = %(date)s ORDER BY booking_time"),
+    ('bookings: GET ?availability=',
+     "SELECT booking_date, booking_time FROM bookings "
+     "WHERE booking_date = ANY(%(days)s) AND status = 'active'"),
+    ('bookings: GET list etag',
+     "SELECT count(*) AS cnt, max(updated_at) AS ts FROM bookings WHERE status = 'active'"),
+    ('bookings: GET list first page',
+     "SELECT id, service, booking_date, booking_time, customer_name, customer_phone, status, cancel_token, created_at "
+     "FROM bookings WHERE status = 'active' ORDER BY booking_date, booking_time, id LIMIT 101"),
+    ('bookings: GET list next page',
+     "SELECT id, service, booking_date, booking_time, customer_name, customer_phone, status, cancel_token, created_at "
+     "FROM bookings WHERE status = 'active' AND (booking_date, booking_time, id) > (%(date)s, %(time)s, %(id)s) "
+     "ORDER BY booking_date, booking_time, id LIMIT 101"),
+    ('bookings: DELETE ?id=',
+     "UPDATE bookings SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE id = %(id)s RETURNING *"),
+    ('bookings: DELETE ?token=',
+     "UPDATE bookings SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP WHERE cancel_token = %(token)s RETURNING *"),
+    ('bot: get_available_times',
+     "SELECT booking_time FROM bookings WHERE booking_date = %(date)s AND status = 'active'"),
+    ('bot: get_user_bookings',
+     "SELECT id, service, booking_date, booking_time FROM bookings "
+     "WHERE customer_phone = %(phone)s AND status = 'active' ORDER BY booking_date, booking_time"),
+    ('bot: get_all_active_bookings',
+     "SELECT id, service, booking_date, booking_time, customer_name, customer_phone "
+     "FROM bookings WHERE status = 'active' ORDER BY booking_date, booking_time"),
+    ('bot: cancel_booking',
+     "UPDATE bookings SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP "
+     "WHERE id = %(id)s AND status = 'active'"),
+]
+
+
+def seed(conn, rows: int, days: int) -> None:
+    """Fill bookings with history: one active booking per slot, the rest cancelled"""
+    start = date.today() - timedelta(days=days - 60)
+    active_slots = days * SLOTS_PER_DAY
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO bookings
+                (service, booking_date, booking_time, customer_name, customer_phone,
+                 status, cancel_token, duration_minutes, created_at, updated_at)
+            SELECT
+                'Классический массаж тело',
+                %(start)s::date + ((i - 1) %% %(days)s),
+                (9 + ((i - 1) / %(days)s) %% %(slots)s)::text || ':00',
+                'Клиент ' || (i %% 50000),
+                '+7900' || lpad((i %% 50000)::text, 7, '0'),
+                CASE WHEN i <= %(active)s THEN 'active' ELSE 'cancelled' END,
+                md5(i::text) || md5((i * 7)::text),
+                60,
+                now() - (i %% 1000) * interval '1 hour',
+                now() - (i %% 1000) * interval '1 hour'
+            FROM generate_series(1, %(rows)s) AS i
+            """,
+            {'start': start, 'days': days, 'slots': SLOTS_PER_DAY, 'active': active_slots, 'rows': rows}
+        )
+    conn.commit()
+
+
+def pick_params(conn) -> Dict[str, Any]:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT id, booking_date, booking_time, customer_phone, cancel_token FROM bookings "
+            "WHERE status = 'active' ORDER BY booking_date DESC, booking_time LIMIT 1 OFFSET 500"
+        )
+        booking_id, booking_date, booking_time, phone, token = cur.fetchone()
+    return {
+        'id': booking_id,
+        'date': booking_date,
+        'time': booking_time,
+        'phone': phone,
+        'token': token,
+        'days': [booking_date + timedelta(days=i) for i in range(31)],
+    }
+
+
+def measure(conn, params: Dict[str, Any], runs: int) -> Dict[str, Dict[str, Any]]:
+    """Median EXPLAIN ANALYZE execution time and top plan node per query"""
+    results = {}
+    with conn.cursor() as cur:
+        for name, sql in QUERIES_V0004:
+            timings = []
+            plan_node = ''
+            for _ in range(runs):
+                cur.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params)
+                plan = cur.fetchone()[0][0]
+                timings.append(plan['Planning Time'] + plan['Execution Time'])
+                plan_node = describe(plan['Plan'])
+                # Изменяющие запросы откатываем, чтобы повторы видели те же данные
+                conn.rollback()
+            results[name] = {'ms': statistics.median(timings), 'plan': plan_node}
+    return results
+
+
+def describe(node: Dict[str, Any]) -> str:
+    """Name of the first scan node in the plan, e.g. 'Index Scan idx_...'"""
+    if 'Scan' in node['Node Type']:
+        index_name = node.get('Index Name')
+        if not index_name and node.get('Plans'):
+            # Bitmap Heap Scan: индекс указан у дочернего Bitmap Index Scan
+            index_name = node['Plans'][0].get('Index Name')
+        return f"{node['Node Type']} {index_name or ''}".strip()
+    for child in node.get('Plans', []):
+        found = describe(child)
+        if found:
+            return found
+    return node['Node Type']
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--days', type=int, default=3650, help='глубина истории в днях')
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--json', help='сохранить результаты в файл')
+    args = parser.parse_args()
+
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print('DATABASE_URL не задан', file=sys.stderr)
+        return 2
+
+    conn = psycopg2.connect(database_url)
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('bookings')")
+        if cur.fetchone()[0] is not None:
+            print('В БД уже есть таблица bookings — нужна пустая база', file=sys.stderr)
+            return 2
+
+    target = migration_version(MIGRATIONS_DIR / INDEX_MIGRATION)
+    apply_migrations(conn, list_migrations(stop=target))
+
+    started = time.perf_counter()
+    seed(conn, args.rows, args.days)
+    print(f'seeded {args.rows} rows in {time.perf_counter() - started:.1f}s')
+
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('VACUUM ANALYZE bookings')
+    conn.autocommit = False
+
+    params = pick_params(conn)
+    before = measure(conn, params, args.runs)
+
+    apply_migrations(conn, list_migrations(start=target, stop=target + 1))
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('VACUUM ANALYZE bookings')
+    conn.autocommit = False
+    after = measure(conn, params, args.runs)
+    conn.close()
+
+    print(f'Frozen V0004 check: queries as of {INDEX_MIGRATION}, not the current handlers')
+    width = max(len(name) for name, _ in QUERIES_V0004)
+    print(f"{'query':<{width}}  {'before ms':>10}  {'after ms':>10}  plan after")
+    for name, _ in QUERIES_V0004:
+        print(f"{name:<{width}}  {before[name]['ms']:>10.3f}  {after[name]['ms']:>10.3f}  {after[name]['plan']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'migration': INDEX_MIGRATION, 'rows': args.rows, 'before': before, 'after': after}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+Business: Слушатель ленты изменений записей: LISTEN bookings_changes и рассылка событий подписчикам
+Args: DATABASE_URL, TELEGRAM_BOT_TOKEN, ADMIN_CHAT_ID из окружения или .env
+Returns: долгоживущий процесс; уведомления администратору о новых и отменённых записях
+
+Триггер из V0009 публикует каждое изменение bookings, кто бы его ни сделал:
+сайт, пакетный POST, админ-панель или бот. Поэтому уведомления идут только
+отсюда, а не из кода каждого пишущего, и без запущенного процесса
+администратор их не получает:
+    DATABASE_URL=postgresql://localhost/loft python bookings-listener/listener.py
+"""
+
+import http.client
+import json
+import os
+import select
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+from urllib.parse import urlsplit
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+
+try:
+    from dotenv import load_dotenv
+except ImportError:  # без python-dotenv переменные берутся только из окружения
+    load_dotenv = None
+
+CHANNEL = 'bookings_changes'
+# Как часто проверять живость соединения, если событий нет (секунды)
+IDLE_CHECK_INTERVAL = 60
+RECONNECT_DELAY = 5
+# Bot API: базовый адрес, тайм-ауты в секундах и повторы; 429 с ожиданием
+# дольше TELEGRAM_MAX_RETRY_AFTER не повторяется
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+TELEGRAM_CONNECT_TIMEOUT = 3
+TELEGRAM_READ_TIMEOUT = 10
+TELEGRAM_MAX_RETRIES = 3
+TELEGRAM_MAX_RETRY_AFTER = 30
+
+Event = Dict[str, Any]
+
+
+class ChangeListener:
+    """Держит LISTEN на отдельном соединении и передаёт каждое событие всем подписчикам"""
+
+    def __init__(self, database_url: str, channel: str = CHANNEL):
+        self.database_url = database_url
+        self.channel = channel
+        self.subscribers: List[Callable[[Event], None]] = []
+        self._conn = None
+
+    def subscribe(self, subscriber: Callable[[Event], None]) -> None:
+        self.subscribers.append(subscriber)
+
+    def connect(self) -> None:
+        conn = psycopg2.connect(self.database_url)
+        conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute('LISTEN ' + self.channel)
+        self._conn = conn
+        print(f'listening on {self.channel}')
+
+    def dispatch(self, event: Event) -> None:
+        for subscriber in self.subscribers:
+            try:
+                subscriber(event)
+            except Exception as e:  # один упавший подписчик не мешает остальным
+                print(f'subscriber {subscriber!r} failed on {event}: {e}', file=sys.stderr)
+
+    def run_forever(self) -> None:
+        while True:
+            try:
+                if self._conn is None:
+                    self.connect()
+                if not select.select([self._conn], [], [], IDLE_CHECK_INTERVAL)[0]:
+                    # Тишина: проверяем, что соединение не оборвалось молча.
+                    # Уведомление, пришедшее перед ответом на SELECT 1, psycopg2
+                    # уже положил в notifies — его разбирает цикл ниже
+                    with self._conn.cursor() as cur:
+                        cur.execute('SELECT 1')
+                else:
+                    self._conn.poll()
+                while self._conn.notifies:
+                    notify = self._conn.notifies.pop(0)
+                    try:
+                        event = json.loads(notify.payload)
+                    except ValueError:
+                        print(f'bad payload: {notify.payload!r}', file=sys.stderr)
+                        continue
+                    self.dispatch(event)
+            except psycopg2.Error as e:
+                # Пока соединения нет, события теряются: подписчики сверяются с БД сами
+                print(f'connection lost: {e}; reconnecting in {RECONNECT_DELAY}s', file=sys.stderr)
+                self.close()
+                time.sleep(RECONNECT_DELAY)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+            self._conn = None
+
+
+class TelegramSender:
+    """
+    Bot API client on one persistent HTTPS connection, so a burst of messages
+    pays for a single TLS handshake. Calls are serialized; network errors and
+    5xx are retried up to max_retries times (the first retry at once, since the
+    usual cause is a keep-alive connection the server has closed), a 429 waits
+    retry_after. Keeps counters for sent, failed and latency
+    """
+
+    def __init__(self, base_url: str, connect_timeout: float, read_timeout: float,
+                 max_retries: int, max_retry_after: float):
+        url = urlsplit(base_url)
+        self.use_tls = url.scheme == 'https'
+        self.host = url.hostname
+        self.port = url.port
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.requests = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self._conn is None:
+            connection_class = http.client.HTTPSConnection if self.use_tls else http.client.HTTPConnection
+            conn = connection_class(self.host, self.port, timeout=self.connect_timeout)
+            conn.connect()
+            conn.sock.settimeout(self.read_timeout)
+            self._conn = conn
+        return self._conn
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def call(self, token: str, method: str, params: Union[Dict[str, Any], str]) -> Optional[Dict[str, Any]]:
+        """Bot API result, or None once the call has failed for good; params may be already encoded"""
+        if not isinstance(params, str):
+            params = json.dumps(params, ensure_ascii=False)
+        body = params.encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        error = None
+        with self._lock:
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    self.retries += 1
+                started = time.perf_counter()
+                try:
+                    conn = self._connection()
+                    conn.request('POST', f'/bot{token}/{method}', body, headers)
+                    response = conn.getresponse()
+                    data = response.read()
+                except (OSError, http.client.HTTPException) as e:
+                    self._close()
+                    error = f'{type(e).__name__}: {e}'
+                    if attempt:
+                        time.sleep(min(0.5 * attempt, self.max_retry_after))
+                    continue
+                latency = time.perf_counter() - started
+                self.requests += 1
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+                if response.will_close:
+                    self._close()
+                try:
+                    result = json.loads(data)
+                except ValueError:
+                    result = {}
+                if response.status == 200 and result.get('ok'):
+                    self.sent += 1
+                    return result
+                error = f"{response.status}: {result.get('description') or data[:200].decode('utf-8', 'replace')}"
+                if response.status == 429:
+                    retry_after = float(result.get('parameters', {}).get('retry_after', 1))
+                    if retry_after > self.max_retry_after:
+                        break
+                    time.sleep(retry_after)
+                elif response.status < 500:
+                    break
+            self.failed += 1
+        print(f"Telegram {method} failed: {error}")
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'sent': self.sent,
+                'failed': self.failed,
+                'retries': self.retries,
+                'requests': self.requests,
+                'latency_avg_ms': round(self.latency_total / self.requests * 1000, 2) if self.requests else 0.0,
+                'latency_max_ms': round(self.latency_max * 1000, 2),
+            }
+
+
+class AdminNotifier:
+    """Сообщение администратору в Telegram о новой или отменённой записи"""
+
+    def __init__(self, database_url: str, bot_token: str, admin_chat_id: str, sender: TelegramSender):
+        self.database_url = database_url
+        self.bot_token = bot_token
+        self.admin_chat_id = admin_chat_id
+        self.sender = sender
+        self._conn = None
+
+    def __call__(self, event: Event) -> None:
+        if event.get('op') == 'insert' and event.get('status') == 'active':
+            title = '🆕 <b>Новая запись!</b>'
+        elif event.get('op') == 'update' and event.get('status') == 'cancelled':
+            title = '❌ <b>Запись отменена</b>'
+        else:
+            return
+        booking = self.fetch_booking(event['id'], event['date'])
+        if booking is None:
+            return
+        self.send(
+            f"{title}\n\n"
+            f"📋 ID: {booking['id']}\n"
+            f"💆 Услуга: {booking['service']}\n"
+            f"📅 Дата: {booking['booking_date']}\n"
+            f"🕐 Время: {booking['booking_time']}\n"
+            f"👤 Клиент: {booking['customer_name']}\n"
+            f"📞 Телефон: {booking['customer_phone']}"
+        )
+
+    def fetch_booking(self, booking_id: int, booking_date: str) -> Dict[str, Any]:
+        # Событие несёт только ключ: имя и телефон клиента не уходят в канал
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(self.database_url)
+            self._conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        try:
+            with self._conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(
+                    "SELECT id, service, booking_date, booking_time, customer_name, customer_phone "
+                    "FROM bookings WHERE id = %s AND booking_date = %s",
+                    (booking_id, booking_date)
+                )
+                return cur.fetchone()
+        except psycopg2.Error:
+            self._conn.close()
+            raise
+
+    def send(self, text: str) -> None:
+        self.sender.call(self.bot_token, 'sendMessage', {'chat_id': self.admin_chat_id, 'text': text, 'parse_mode': 'HTML'})
+
+
+def log_event(event: Event) -> None:
+    print(json.dumps(event, ensure_ascii=False))
+
+
+def main() -> int:
+    if load_dotenv is not None:
+        load_dotenv()
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print('DATABASE_URL не задан', file=sys.stderr)
+        return 2
+
+    listener = ChangeListener(database_url)
+    listener.subscribe(log_event)
+    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    admin_chat_id = os.environ.get('ADMIN_CHAT_ID')
+    sender = TelegramSender(
+        TELEGRAM_API_URL, TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT,
+        TELEGRAM_MAX_RETRIES, TELEGRAM_MAX_RETRY_AFTER
+    )
+    if bot_token and admin_chat_id:
+        listener.subscribe(AdminNotifier(database_url, bot_token, admin_chat_id, sender))
+    else:
+        print('TELEGRAM_BOT_TOKEN или ADMIN_CHAT_ID не заданы: уведомления администратору отключены', file=sys.stderr)
+
+    try:
+        listener.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        print(json.dumps({'telegram': sender.stats()}))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+-- Записи, которые миграции сняли из-за конфликта слотов: строка целиком
+-- в том виде, какой она была до отмены, и запись, оставшаяся на этом слоте.
+-- По этой таблице администратор связывается с клиентами
+CREATE TABLE IF NOT EXISTS booking_migration_conflicts (
+    id SERIAL PRIMARY KEY,
+    migration VARCHAR(32) NOT NULL,
+    booking_id INTEGER NOT NULL,
+    conflicts_with_id INTEGER NOT NULL,
+    booking JSONB NOT NULL,
+    recorded_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Дубли активных записей на один слот (остаётся самая ранняя)
+INSERT INTO booking_migration_conflicts (migration, booking_id, conflicts_with_id, booking)
+SELECT 'V0002', b.id, kept.id, to_jsonb(b)
+FROM bookings b
+CROSS JOIN LATERAL (
+    SELECT min(older.id) AS id FROM bookings older
+    WHERE older.status = 'active'
+      AND older.booking_date = b.booking_date
+      AND older.booking_time = b.booking_time
+      AND older.id < b.id
+) kept
+WHERE b.status = 'active'
+  AND kept.id IS NOT NULL;
+
+DO $$
+DECLARE
+    conflicts INTEGER;
+BEGIN
+    SELECT count(*) INTO conflicts FROM booking_migration_conflicts WHERE migration = 'V0002';
+    IF conflicts > 0 THEN
+        RAISE WARNING 'V0002: % active bookings share a slot with an earlier one and will be cancelled, see booking_migration_conflicts', conflicts;
+    END IF;
+END $$;
+
+-- Снимаем дубли, сохранённые выше
+UPDATE bookings b
+SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+WHERE b.id IN (SELECT booking_id FROM booking_migration_conflicts WHERE migration = 'V0002');
+
+-- Один активный слот на дату и время: гарантия от двойной записи на уровне БД
+CREATE UNIQUE INDEX IF NOT EXISTS uq_bookings_active_slot
+    ON bookings(booking_date, booking_time)
+    WHERE status = 'active';
@@ -0,0 +1,70 @@
+-- Длительность сеанса: 30 минут для массажа спины, 60 — для массажа тела
+ALTER TABLE bookings ADD COLUMN IF NOT EXISTS duration_minutes SMALLINT NOT NULL DEFAULT 60;
+
+-- Интервал сеанса [начало, конец) как типизированное время вместо строки
+ALTER TABLE bookings ADD COLUMN IF NOT EXISTS slot TSRANGE;
+
+-- Интервал считается из booking_date, booking_time и duration_minutes.
+-- Время в формате, отличном от ЧЧ:ММ, оставляет slot пустым (как раньше,
+-- такие записи проверяются только уникальным индексом по точному времени)
+CREATE OR REPLACE FUNCTION bookings_fill_slot() RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.booking_time ~ '^([01]?[0-9]|2[0-3]):[0-5][0-9]$' THEN
+        NEW.slot := tsrange(
+            NEW.booking_date + NEW.booking_time::time,
+            NEW.booking_date + NEW.booking_time::time + make_interval(mins => NEW.duration_minutes),
+            '[)'
+        );
+    ELSE
+        NEW.slot := NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bookings_fill_slot ON bookings;
+CREATE TRIGGER trg_bookings_fill_slot
+    BEFORE INSERT OR UPDATE OF booking_date, booking_time, duration_minutes ON bookings
+    FOR EACH ROW EXECUTE FUNCTION bookings_fill_slot();
+
+-- Заполнение для существующих записей (триггер пересчитает slot)
+UPDATE bookings
+SET duration_minutes = CASE
+    WHEN service IN ('Классический массаж спина', 'Успокаивающий массаж спина') THEN 30
+    ELSE 60
+END;
+
+-- Пересекающиеся активные записи (остаётся более ранняя) сохраняются
+-- в booking_migration_conflicts из V0002 до отмены
+INSERT INTO booking_migration_conflicts (migration, booking_id, conflicts_with_id, booking)
+SELECT 'V0003', b.id, kept.id, to_jsonb(b)
+FROM bookings b
+CROSS JOIN LATERAL (
+    SELECT min(older.id) AS id FROM bookings older
+    WHERE older.status = 'active'
+      AND older.id < b.id
+      AND older.slot && b.slot
+) kept
+WHERE b.status = 'active'
+  AND b.slot IS NOT NULL
+  AND kept.id IS NOT NULL;
+
+DO $$
+DECLARE
+    conflicts INTEGER;
+BEGIN
+    SELECT count(*) INTO conflicts FROM booking_migration_conflicts WHERE migration = 'V0003';
+    IF conflicts > 0 THEN
+        RAISE WARNING 'V0003: % active bookings overlap an earlier one and will be cancelled, see booking_migration_conflicts', conflicts;
+    END IF;
+END $$;
+
+-- Снимаем пересечения, сохранённые выше
+UPDATE bookings b
+SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+WHERE b.id IN (SELECT booking_id FROM booking_migration_conflicts WHERE migration = 'V0003');
+
+-- Активные сеансы не могут пересекаться по времени: одна проверка по GiST-индексу
+ALTER TABLE bookings DROP CONSTRAINT IF EXISTS excl_bookings_active_slot;
+ALTER TABLE bookings ADD CONSTRAINT excl_bookings_active_slot
+    EXCLUDE USING gist (slot WITH &&) WHERE (status = 'active');
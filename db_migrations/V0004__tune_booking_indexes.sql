@@ -0,0 +1,19 @@
+-- Дубликат индекса, который уже создаёт ограничение UNIQUE на cancel_token
+DROP INDEX IF EXISTS idx_bookings_cancel_token;
+
+-- Записи на дату (все статусы) с сортировкой по времени; updated_at в индексе
+-- позволяет считать ETag дня без чтения таблицы
+DROP INDEX IF EXISTS idx_bookings_date;
+CREATE INDEX IF NOT EXISTS idx_bookings_date_time
+    ON bookings(booking_date, booking_time) INCLUDE (updated_at);
+
+-- Активные записи в порядке админ-списка и постраничной выдачи по ключу
+-- (booking_date, booking_time, id); покрывает и ETag активного набора
+CREATE INDEX IF NOT EXISTS idx_bookings_active_order
+    ON bookings(booking_date, booking_time, id) INCLUDE (updated_at)
+    WHERE status = 'active';
+
+-- «Мои записи» в боте: активные записи клиента по телефону
+CREATE INDEX IF NOT EXISTS idx_bookings_active_phone
+    ON bookings(customer_phone, booking_date, booking_time)
+    WHERE status = 'active';
@@ -0,0 +1,12 @@
+-- Ключи идемпотентности POST: повтор запроса с тем же Idempotency-Key
+-- получает исходную запись одним поиском по первичному ключу.
+-- Хранится SHA-256 ключа (32 байта), а не сам ключ клиента
+CREATE TABLE IF NOT EXISTS booking_idempotency_keys (
+    key_hash BYTEA PRIMARY KEY,
+    booking_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Для очистки ключей старше TTL
+CREATE INDEX IF NOT EXISTS idx_booking_idempotency_keys_created
+    ON booking_idempotency_keys(created_at);
@@ -0,0 +1,13 @@
+-- Токен отмены хранится только как SHA-256 (32 байта): открытый токен
+-- есть лишь в ссылке отмены, и дамп БД не позволяет отменять записи
+ALTER TABLE bookings ADD COLUMN IF NOT EXISTS cancel_token_hash BYTEA;
+
+UPDATE bookings
+SET cancel_token_hash = sha256(convert_to(cancel_token, 'UTF8'))
+WHERE cancel_token IS NOT NULL AND cancel_token_hash IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_bookings_cancel_token_hash
+    ON bookings(cancel_token_hash);
+
+-- Вместе со столбцом удаляется и широкий текстовый индекс UNIQUE
+ALTER TABLE bookings DROP COLUMN IF EXISTS cancel_token;
@@ -0,0 +1,171 @@
+-- Помесячное секционирование bookings по booking_date: запросы с условием
+-- по дате читают только свои секции, а прошедшие месяцы отсоединяются
+-- от таблицы целиком (bookings_maintain_partitions)
+
+-- Последовательность id переживает пересоздание таблицы
+ALTER SEQUENCE bookings_id_seq OWNED BY NONE;
+
+ALTER TABLE bookings RENAME TO bookings_unpartitioned;
+ALTER TABLE bookings_unpartitioned RENAME CONSTRAINT bookings_pkey TO bookings_unpartitioned_pkey;
+ALTER TABLE bookings_unpartitioned DROP CONSTRAINT IF EXISTS excl_bookings_active_slot;
+DROP TRIGGER IF EXISTS trg_bookings_fill_slot ON bookings_unpartitioned;
+DROP INDEX IF EXISTS uq_bookings_active_slot;
+DROP INDEX IF EXISTS uq_bookings_cancel_token_hash;
+DROP INDEX IF EXISTS idx_bookings_date_time;
+DROP INDEX IF EXISTS idx_bookings_active_order;
+DROP INDEX IF EXISTS idx_bookings_active_phone;
+
+CREATE TABLE bookings (
+    id INTEGER NOT NULL DEFAULT nextval('bookings_id_seq'),
+    service VARCHAR(255) NOT NULL,
+    booking_date DATE NOT NULL,
+    booking_time VARCHAR(10) NOT NULL,
+    customer_name VARCHAR(255) NOT NULL,
+    customer_phone VARCHAR(50) NOT NULL,
+    status VARCHAR(50) DEFAULT 'active',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    duration_minutes SMALLINT NOT NULL DEFAULT 60,
+    slot TSRANGE,
+    cancel_token_hash BYTEA,
+    -- Уникальные ключи секционированной таблицы обязаны содержать booking_date
+    PRIMARY KEY (id, booking_date)
+) PARTITION BY RANGE (booking_date);
+
+ALTER SEQUENCE bookings_id_seq OWNED BY bookings.id;
+
+-- Индексы из V0002, V0004 и V0006; создаются в каждой секции
+CREATE UNIQUE INDEX uq_bookings_active_slot
+    ON bookings(booking_date, booking_time)
+    WHERE status = 'active';
+
+-- Токен случайный (256 бит), поэтому уникальность в пределах даты
+-- равносильна глобальной
+CREATE UNIQUE INDEX uq_bookings_cancel_token_hash
+    ON bookings(cancel_token_hash, booking_date);
+
+CREATE INDEX idx_bookings_date_time
+    ON bookings(booking_date, booking_time) INCLUDE (updated_at);
+
+CREATE INDEX idx_bookings_active_order
+    ON bookings(booking_date, booking_time, id) INCLUDE (updated_at)
+    WHERE status = 'active';
+
+CREATE INDEX idx_bookings_active_phone
+    ON bookings(customer_phone, booking_date, booking_time)
+    WHERE status = 'active';
+
+CREATE TRIGGER trg_bookings_fill_slot
+    BEFORE INSERT OR UPDATE OF booking_date, booking_time, duration_minutes ON bookings
+    FOR EACH ROW EXECUTE FUNCTION bookings_fill_slot();
+
+-- Ограничение EXCLUDE на секционированную таблицу не ставится,
+-- поэтому пересечение сеансов проверяется в каждой секции отдельно
+CREATE OR REPLACE FUNCTION bookings_add_slot_exclusion(part_name TEXT) RETURNS VOID AS $$
+BEGIN
+    EXECUTE format(
+        'ALTER TABLE %I ADD CONSTRAINT %I EXCLUDE USING gist (slot WITH &&) WHERE (status = ''active'')',
+        part_name, 'excl_' || part_name || '_active_slot'
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Записи на даты без своей секции (дальше горизонта или в архивных
+-- месяцах) попадают сюда, а не в ошибку
+CREATE TABLE bookings_default PARTITION OF bookings DEFAULT;
+SELECT bookings_add_slot_exclusion('bookings_default');
+
+-- Секция месяца bookings_pГГГГ_ММ. Таблица создаётся отдельно и
+-- подключается ATTACH, чтобы сначала перенести в неё записи этого
+-- месяца из bookings_default. Возвращает имя созданной секции или NULL
+CREATE OR REPLACE FUNCTION bookings_create_partition(month_start DATE) RETURNS TEXT AS $$
+DECLARE
+    range_start DATE := date_trunc('month', month_start)::date;
+    range_end DATE := (date_trunc('month', month_start) + interval '1 month')::date;
+    part_name TEXT := 'bookings_p' || to_char(month_start, 'YYYY_MM');
+BEGIN
+    IF to_regclass(part_name) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE bookings INCLUDING DEFAULTS)', part_name);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM bookings_default WHERE booking_date >= $1 AND booking_date < $2 RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved',
+        part_name
+    ) USING range_start, range_end;
+    EXECUTE format(
+        'ALTER TABLE bookings ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        part_name, range_start, range_end
+    );
+    PERFORM bookings_add_slot_exclusion(part_name);
+    RETURN part_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Обслуживание: секции на months_ahead месяцев вперёд и отсоединение
+-- месяцев старше keep_months. Отсоединённая секция переименовывается
+-- в bookings_archive_ГГГГ_ММ и остаётся в БД как обычная таблица
+CREATE OR REPLACE FUNCTION bookings_maintain_partitions(months_ahead INTEGER DEFAULT 12, keep_months INTEGER DEFAULT 3)
+RETURNS TABLE(action TEXT, partition_name TEXT) AS $$
+DECLARE
+    current_month DATE := date_trunc('month', CURRENT_DATE)::date;
+    archive_before DATE := (date_trunc('month', CURRENT_DATE) - make_interval(months => keep_months))::date;
+    month_start DATE;
+    created TEXT;
+    part RECORD;
+BEGIN
+    FOR month_start IN
+        SELECT generate_series(current_month, current_month + make_interval(months => months_ahead), interval '1 month')::date
+    LOOP
+        created := bookings_create_partition(month_start);
+        IF created IS NOT NULL THEN
+            action := 'created';
+            partition_name := created;
+            RETURN NEXT;
+        END IF;
+    END LOOP;
+
+    FOR part IN
+        SELECT c.relname AS name, to_date(right(c.relname, 7), 'YYYY_MM') AS month
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'bookings'::regclass
+          AND c.relname ~ '^bookings_p[0-9]{4}_[0-9]{2}$'
+        ORDER BY 2
+    LOOP
+        EXIT WHEN part.month >= archive_before;
+        EXECUTE format('ALTER TABLE bookings DETACH PARTITION %I', part.name);
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', part.name, 'bookings_archive_' || right(part.name, 7));
+        action := 'archived';
+        partition_name := 'bookings_archive_' || right(part.name, 7);
+        RETURN NEXT;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Секции для всей истории и на год вперёд, затем перенос записей
+SELECT bookings_create_partition(m::date)
+FROM generate_series(
+    date_trunc('month', LEAST((SELECT min(booking_date) FROM bookings_unpartitioned), CURRENT_DATE)),
+    date_trunc('month', GREATEST((SELECT max(booking_date) FROM bookings_unpartitioned), CURRENT_DATE + interval '12 months')),
+    interval '1 month'
+) AS m;
+
+INSERT INTO bookings
+    (id, service, booking_date, booking_time, customer_name, customer_phone, status,
+     created_at, updated_at, duration_minutes, cancel_token_hash)
+SELECT id, service, booking_date, booking_time, customer_name, customer_phone, status,
+       created_at, updated_at, duration_minutes, cancel_token_hash
+FROM bookings_unpartitioned;
+
+DROP TABLE bookings_unpartitioned;
+
+-- Ключ идемпотентности хранит и дату записи: поиск повтора идёт
+-- по первичному ключу одной секции
+ALTER TABLE booking_idempotency_keys ADD COLUMN IF NOT EXISTS booking_date DATE;
+
+UPDATE booking_idempotency_keys k
+SET booking_date = b.booking_date
+FROM bookings b
+WHERE b.id = k.booking_id AND k.booking_date IS NULL;
@@ -0,0 +1,100 @@
+-- Сводка для аналитики админ-панели: число записей и отмен по дню,
+-- услуге и времени. Обновляется триггером в той же транзакции, что и
+-- сама запись, поэтому её поддерживают все пишущие: API, пакетный POST
+-- и телеграм-бот. Отсоединение архивных секций сводку не меняет
+CREATE TABLE IF NOT EXISTS booking_stats (
+    booking_date DATE NOT NULL,
+    service VARCHAR(255) NOT NULL,
+    booking_time VARCHAR(10) NOT NULL,
+    booked INTEGER NOT NULL DEFAULT 0,
+    cancelled INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (booking_date, service, booking_time)
+);
+
+CREATE OR REPLACE FUNCTION booking_stats_apply(
+    stat_date DATE, stat_service VARCHAR, stat_time VARCHAR, booked_delta INTEGER, cancelled_delta INTEGER
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO booking_stats (booking_date, service, booking_time, booked, cancelled)
+    VALUES (stat_date, stat_service, stat_time, booked_delta, cancelled_delta)
+    ON CONFLICT (booking_date, service, booking_time) DO UPDATE
+    SET booked = booking_stats.booked + EXCLUDED.booked,
+        cancelled = booking_stats.cancelled + EXCLUDED.cancelled;
+END;
+$$ LANGUAGE plpgsql SET search_path FROM CURRENT;
+
+-- Вклад строки: +1 запись, +1 отмена для статуса cancelled. При изменении
+-- вычитается вклад старой версии строки и добавляется вклад новой.
+-- Перенос строк между секциями (bookings_create_partition) выставляет
+-- bookings.skip_stats и сводку не трогает.
+-- Схема функций фиксируется при создании: бот пишет в bookings по полному
+-- имени таблицы, и его search_path может не содержать эту схему
+CREATE OR REPLACE FUNCTION bookings_update_stats() RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('bookings.skip_stats', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE'
+       AND NEW.booking_date = OLD.booking_date
+       AND NEW.service = OLD.service
+       AND NEW.booking_time = OLD.booking_time
+       AND (NEW.status = 'cancelled') = (OLD.status = 'cancelled') THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM booking_stats_apply(
+            OLD.booking_date, OLD.service, OLD.booking_time,
+            -1, CASE WHEN OLD.status = 'cancelled' THEN -1 ELSE 0 END
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM booking_stats_apply(
+            NEW.booking_date, NEW.service, NEW.booking_time,
+            1, CASE WHEN NEW.status = 'cancelled' THEN 1 ELSE 0 END
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SET search_path FROM CURRENT;
+
+DROP TRIGGER IF EXISTS trg_bookings_update_stats ON bookings;
+CREATE TRIGGER trg_bookings_update_stats
+    AFTER INSERT OR UPDATE OR DELETE ON bookings
+    FOR EACH ROW EXECUTE FUNCTION bookings_update_stats();
+
+-- Перенос из bookings_default удаляет строки из секции с триггером
+-- и вставляет их в ещё не подключённую таблицу без него
+CREATE OR REPLACE FUNCTION bookings_create_partition(month_start DATE) RETURNS TEXT AS $$
+DECLARE
+    range_start DATE := date_trunc('month', month_start)::date;
+    range_end DATE := (date_trunc('month', month_start) + interval '1 month')::date;
+    part_name TEXT := 'bookings_p' || to_char(month_start, 'YYYY_MM');
+BEGIN
+    IF to_regclass(part_name) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE bookings INCLUDING DEFAULTS)', part_name);
+    PERFORM set_config('bookings.skip_stats', 'on', true);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM bookings_default WHERE booking_date >= $1 AND booking_date < $2 RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved',
+        part_name
+    ) USING range_start, range_end;
+    PERFORM set_config('bookings.skip_stats', 'off', true);
+    EXECUTE format(
+        'ALTER TABLE bookings ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        part_name, range_start, range_end
+    );
+    PERFORM bookings_add_slot_exclusion(part_name);
+    RETURN part_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Сводка по уже существующим записям
+INSERT INTO booking_stats (booking_date, service, booking_time, booked, cancelled)
+SELECT booking_date, service, booking_time, count(*), count(*) FILTER (WHERE status = 'cancelled')
+FROM bookings
+GROUP BY booking_date, service, booking_time
+ON CONFLICT (booking_date, service, booking_time) DO UPDATE
+SET booked = EXCLUDED.booked, cancelled = EXCLUDED.cancelled;
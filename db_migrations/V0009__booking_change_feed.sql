@@ -0,0 +1,48 @@
+-- Лента изменений записей: после коммита каждое создание, отмена или
+-- удаление записи публикуется в канал bookings_changes компактным JSON
+-- {"op", "id", "date", "time", "status"}. Кэши обработчиков и слушатель
+-- уведомлений подписываются на канал (LISTEN) вместо опроса таблицы
+CREATE OR REPLACE FUNCTION bookings_notify_change() RETURNS TRIGGER AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    -- Перенос строк между секциями — не изменение записи
+    IF current_setting('bookings.skip_stats', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE'
+       AND NEW.status IS NOT DISTINCT FROM OLD.status
+       AND NEW.booking_date = OLD.booking_date
+       AND NEW.booking_time = OLD.booking_time THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        r := OLD;
+    ELSE
+        r := NEW;
+    END IF;
+    PERFORM pg_notify('bookings_changes', json_build_object(
+        'op', lower(TG_OP),
+        'id', r.id,
+        'date', r.booking_date,
+        'time', r.booking_time,
+        'status', r.status
+    )::text);
+    -- Перенос записи на другой день освобождает слот старой даты
+    IF TG_OP = 'UPDATE' AND NEW.booking_date <> OLD.booking_date THEN
+        PERFORM pg_notify('bookings_changes', json_build_object(
+            'op', 'update',
+            'id', OLD.id,
+            'date', OLD.booking_date,
+            'time', OLD.booking_time,
+            'status', 'moved'
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bookings_notify_change ON bookings;
+CREATE TRIGGER trg_bookings_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON bookings
+    FOR EACH ROW EXECUTE FUNCTION bookings_notify_change();
@@ -0,0 +1,12 @@
+-- Состояние диалога телеграм-бота (шаг записи и введённые данные) по чату.
+-- Хранится в БД, чтобы шаг не терялся при запуске нового контейнера;
+-- строка живёт до expires_at, просроченные удаляются самим ботом
+CREATE TABLE IF NOT EXISTS bot_conversation_states (
+    chat_id VARCHAR(64) PRIMARY KEY,
+    state JSONB NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- Для очистки просроченных состояний
+CREATE INDEX IF NOT EXISTS idx_bot_conversation_states_expires
+    ON bot_conversation_states(expires_at);
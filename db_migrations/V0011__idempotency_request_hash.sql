@@ -0,0 +1,5 @@
+-- SHA-256 тела запроса, с которым ключ идемпотентности был использован впервые.
+-- Повтор ключа с другим телом получает 422, а не чужую запись.
+-- У ключей, сохранённых до миграции, хэша нет — они сверяются только по ключу
+-- и через IDEMPOTENCY_KEY_TTL_HOURS удаляются
+ALTER TABLE booking_idempotency_keys ADD COLUMN IF NOT EXISTS request_hash BYTEA;
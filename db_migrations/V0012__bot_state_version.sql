@@ -0,0 +1,5 @@
+-- Версия состояния диалога: каждая запись увеличивает её на 1. Бот пишет
+-- и удаляет состояние только если версия та же, что он прочитал; иначе
+-- сообщение этого чата уже обработал другой контейнер, и бот перечитывает
+-- состояние и обрабатывает сообщение заново
+ALTER TABLE bot_conversation_states ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1;
@@ -24,7 +24,7 @@ interface BookingModalProps {
   setCustomerName: (name: string) => void
   customerPhone: string
   setCustomerPhone: (phone: string) => void
-  onConfirmBooking: () => void
+  onConfirmBooking: () => Promise<boolean>
 }
 
 export default function BookingModal({
@@ -43,37 +43,69 @@ export default function BookingModal({
   setCustomerPhone,
   onConfirmBooking
 }: BookingModalProps) {
-  const [bookedSlots, setBookedSlots] = useState<string[]>([])
+  const [freeSlots, setFreeSlots] = useState<Record<string, string[]>>({})
+  const [loadedMonths, setLoadedMonths] = useState<string[]>([])
   const [loading, setLoading] = useState(false)
 
+  // Слоты могли занять, пока окно было закрыто: при открытии месяцы
+  // загружаются заново (ответ с ETag, без изменений сервер вернёт 304)
+  useEffect(() => {
+    if (show) {
+      setLoadedMonths([])
+      if (selectedDate) {
+        fetchMonthAvailability(true)
+      }
+    }
+  }, [show])
+
   useEffect(() => {
     if (selectedDate) {
-      fetchBookedSlots()
+      fetchMonthAvailability()
     }
   }, [selectedDate])
 
-  const fetchBookedSlots = async () => {
-    if (!selectedDate) return
+  // Один запрос на весь месяц: свободные слоты по дням
+  const fetchMonthAvailability = async (force = false): Promise<Record<string, string[]> | null> => {
+    if (!selectedDate) return null
+
+    const year = selectedDate.getUTCFullYear()
+    const month = selectedDate.getUTCMonth()
+    const monthKey = `${year}-${month}`
+    if (!force && loadedMonths.includes(monthKey)) return null
     
     setLoading(true)
     try {
-      const dateStr = selectedDate.toISOString().split('T')[0]
-      const response = await fetch(`https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04?date=${dateStr}`)
-      const bookings = await response.json()
-      
-      const slots = bookings
-        .filter((b: any) => b.status === 'active')
-        .map((b: any) => b.booking_time)
+      const from = new Date(Date.UTC(year, month, 1)).toISOString().split('T')[0]
+      const to = new Date(Date.UTC(year, month + 1, 0)).toISOString().split('T')[0]
+      const response = await fetch(`https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04?availability=1&from=${from}&to=${to}`)
+      const data = await response.json()
       
-      setBookedSlots(slots)
+      setFreeSlots(prev => ({ ...prev, ...data.days }))
+      setLoadedMonths(prev => (prev.includes(monthKey) ? prev : [...prev, monthKey]))
+      return data.days
     } catch (error) {
-      console.error('Failed to fetch bookings:', error)
-      setBookedSlots([])
+      console.error('Failed to fetch availability:', error)
+      return null
     } finally {
       setLoading(false)
     }
   }
 
+  // Запись не создана (например, 409 — время заняли): показываем
+  // актуальные слоты и снимаем выбор, если выбранное время уже занято
+  const handleConfirm = async () => {
+    const created = await onConfirmBooking()
+    if (created) return
+    const days = await fetchMonthAvailability(true)
+    const dateStr = selectedDate ? selectedDate.toISOString().split('T')[0] : null
+    if (days && dateStr && selectedTime && !(days[dateStr] || []).includes(selectedTime)) {
+      setSelectedTime(null)
+    }
+  }
+
+  const selectedDateStr = selectedDate ? selectedDate.toISOString().split('T')[0] : null
+  const dayFreeSlots = selectedDateStr ? freeSlots[selectedDateStr] : undefined
+
   if (!show) return null
 
   return (
@@ -166,7 +198,7 @@ export default function BookingModal({
                   }
                   
                   return times.map(time => {
-                    const isBooked = bookedSlots.includes(time)
+                    const isBooked = dayFreeSlots ? !dayFreeSlots.includes(time) : false
                     return (
                       <button
                         key={time}
@@ -215,7 +247,7 @@ export default function BookingModal({
           {selectedService && selectedDate && selectedTime && customerName && customerPhone && (
             <Button 
               className="w-full bg-industrial hover:bg-industrial/90 text-white text-lg py-6"
-              onClick={onConfirmBooking}
+              onClick={handleConfirm}
             >
               Подтвердить запись
             </Button>
@@ -11,22 +11,72 @@ interface Booking {
   customer_name: string
   customer_phone: string
   status: string
-  cancel_token: string
   created_at: string
 }
 
+interface BookingStats {
+  booked: number
+  cancelled: number
+  cancellation_rate: number
+}
+
+// Первый и последний день текущего месяца в формате ГГГГ-ММ-ДД
+const currentMonthRange = () => {
+  const now = new Date()
+  const pad = (n: number) => String(n).padStart(2, '0')
+  const lastDay = new Date(now.getFullYear(), now.getMonth() + 1, 0).getDate()
+  const month = `${now.getFullYear()}-${pad(now.getMonth() + 1)}`
+  return { from: `${month}-01`, to: `${month}-${pad(lastDay)}` }
+}
+
+// Токен для пакетной отмены (ADMIN_TOKEN функции bookings): спрашивается
+// один раз и живёт до закрытия вкладки
+const getAdminToken = () => {
+  let token = sessionStorage.getItem('adminToken')
+  if (!token) {
+    token = prompt('Токен администратора') || ''
+    if (token) sessionStorage.setItem('adminToken', token)
+  }
+  return token
+}
+
 export default function Admin() {
   const [bookings, setBookings] = useState<Booking[]>([])
   const [loading, setLoading] = useState(true)
   const [selectedDate, setSelectedDate] = useState<string>(new Date().toISOString().split('T')[0])
   const [filter, setFilter] = useState<'all' | 'active' | 'cancelled'>('active')
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const [monthStats, setMonthStats] = useState<BookingStats | null>(null)
 
-  const loadBookings = async () => {
+  // Сводка за месяц считается на сервере по агрегированной таблице
+  const loadStats = async () => {
+    const { from, to } = currentMonthRange()
+    try {
+      const response = await fetch(`https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04?stats=1&from=${from}&to=${to}`)
+      setMonthStats(await response.json())
+    } catch (error) {
+      console.error('Ошибка загрузки статистики:', error)
+    }
+  }
+
+  // Список отдаётся страницами; after — курсор следующей страницы.
+  // Записи выбранной даты приходят одним запросом ?date= целиком
+  const loadBookings = async (after: string | null = null) => {
     setLoading(true)
     try {
-      const response = await fetch('https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04')
-      const data = await response.json()
-      setBookings(data)
+      if (selectedDate) {
+        const response = await fetch(`https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04?date=${selectedDate}`)
+        setBookings(await response.json())
+        setNextCursor(null)
+      } else {
+        const url = after
+          ? `https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04?after=${encodeURIComponent(after)}`
+          : 'https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04'
+        const response = await fetch(url)
+        const data = await response.json()
+        setBookings(prev => after ? [...prev, ...data.bookings] : data.bookings)
+        setNextCursor(data.next)
+      }
     } catch (error) {
       console.error('Ошибка загрузки записей:', error)
     }
@@ -34,29 +84,61 @@ export default function Admin() {
   }
 
   useEffect(() => {
-    loadBookings()
+    loadStats()
   }, [])
 
-  const cancelBooking = async (id: number) => {
+  useEffect(() => {
+    loadBookings()
+  }, [selectedDate])
+
+  const cancelBooking = async (booking: Booking) => {
     if (!confirm('Отменить эту запись?')) return
     
     try {
-      const response = await fetch(`https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04?id=${id}`, {
+      const response = await fetch(`https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04?id=${booking.id}&date=${booking.booking_date}`, {
         method: 'DELETE'
       })
       
       if (response.ok) {
         alert('Запись отменена')
         loadBookings()
+        loadStats()
       }
     } catch (error) {
       alert('Ошибка при отмене записи')
     }
   }
 
+  // Отмена всех активных записей дня одним запросом (например, при болезни мастера)
+  const cancelDay = async (day: string) => {
+    if (!day || !confirm(`Отменить все записи на ${day}?`)) return
+    const adminToken = getAdminToken()
+    if (!adminToken) return
+    
+    try {
+      const response = await fetch(`https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04?date=${day}`, {
+        method: 'DELETE',
+        headers: { 'X-Admin-Token': adminToken }
+      })
+      
+      if (response.status === 401) {
+        sessionStorage.removeItem('adminToken')
+        alert('Неверный токен администратора')
+        return
+      }
+      if (response.ok) {
+        const data = await response.json()
+        alert(`Отменено записей: ${data.cancelled.length}`)
+        loadBookings()
+        loadStats()
+      }
+    } catch (error) {
+      alert('Ошибка при отмене записей')
+    }
+  }
+
   const filteredBookings = bookings
     .filter(b => filter === 'all' ? true : b.status === filter)
-    .filter(b => selectedDate ? b.booking_date === selectedDate : true)
     .sort((a, b) => {
       if (a.booking_date === b.booking_date) {
         return a.booking_time.localeCompare(b.booking_time)
@@ -65,9 +147,10 @@ export default function Admin() {
     })
 
   const stats = {
-    total: bookings.length,
-    active: bookings.filter(b => b.status === 'active').length,
-    cancelled: bookings.filter(b => b.status === 'cancelled').length
+    total: monthStats?.booked ?? 0,
+    active: monthStats ? monthStats.booked - monthStats.cancelled : 0,
+    cancelled: monthStats?.cancelled ?? 0,
+    cancellationRate: Math.round((monthStats?.cancellation_rate ?? 0) * 100)
   }
 
   return (
@@ -82,7 +165,7 @@ export default function Admin() {
         <div className="grid grid-cols-1 md:grid-cols-3 gap-4 mb-8">
           <Card>
             <CardHeader className="pb-3">
-              <CardTitle className="text-sm text-foreground/70">Всего записей</CardTitle>
+              <CardTitle className="text-sm text-foreground/70">Записей за месяц</CardTitle>
             </CardHeader>
             <CardContent>
               <p className="text-3xl font-bold">{stats.total}</p>
@@ -102,6 +185,7 @@ export default function Admin() {
             </CardHeader>
             <CardContent>
               <p className="text-3xl font-bold text-red-600">{stats.cancelled}</p>
+              <p className="text-sm text-foreground/70">{stats.cancellationRate}% от всех записей</p>
             </CardContent>
           </Card>
         </div>
@@ -132,11 +216,21 @@ export default function Admin() {
                 </select>
               </div>
               <div className="flex items-end">
-                <Button onClick={loadBookings} className="bg-industrial hover:bg-industrial/90 text-white">
+                <Button onClick={() => loadBookings()} className="bg-industrial hover:bg-industrial/90 text-white">
                   <Icon name="RefreshCw" size={20} className="mr-2" />
                   Обновить
                 </Button>
               </div>
+              <div className="flex items-end">
+                <Button
+                  variant="destructive"
+                  onClick={() => cancelDay(selectedDate)}
+                  disabled={!selectedDate}
+                >
+                  <Icon name="CalendarX" size={20} className="mr-2" />
+                  Отменить день
+                </Button>
+              </div>
             </div>
           </CardContent>
         </Card>
@@ -200,22 +294,10 @@ export default function Admin() {
                       
                       {booking.status === 'active' && (
                         <div className="flex gap-2">
-                          <Button
-                            variant="outline"
-                            size="sm"
-                            onClick={() => {
-                              const cancelUrl = `${window.location.origin}/cancel?token=${booking.cancel_token}`
-                              navigator.clipboard.writeText(cancelUrl)
-                              alert('Ссылка для отмены скопирована в буфер обмена')
-                            }}
-                          >
-                            <Icon name="Link" size={16} className="mr-2" />
-                            Ссылка
-                          </Button>
                           <Button
                             variant="destructive"
                             size="sm"
-                            onClick={() => cancelBooking(booking.id)}
+                            onClick={() => cancelBooking(booking)}
                           >
                             <Icon name="Trash2" size={16} className="mr-2" />
                             Отменить
@@ -225,6 +307,11 @@ export default function Admin() {
                     </div>
                   </div>
                 ))}
+                {nextCursor && (
+                  <Button variant="outline" className="w-full" onClick={() => loadBookings(nextCursor)}>
+                    Загрузить ещё
+                  </Button>
+                )}
               </div>
             )}
           </CardContent>
@@ -28,12 +28,21 @@ export default function Cancel() {
       return
     }
 
-    loadBooking(token)
+    loadBooking()
   }, [])
 
-  const loadBooking = async (token: string) => {
+  // Дата записи в ссылке сужает поиск по токену до одного месяца;
+  // в ссылках, выданных раньше, её нет
+  const bookingQuery = () => {
+    const params = new URLSearchParams(window.location.search)
+    const token = params.get('token')
+    const date = params.get('date')
+    return date ? `token=${token}&date=${date}` : `token=${token}`
+  }
+
+  const loadBooking = async () => {
     try {
-      const response = await fetch(`https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04?token=${token}`)
+      const response = await fetch(`https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04?${bookingQuery()}`)
       const data = await response.json()
 
       if (response.ok) {
@@ -53,11 +62,8 @@ export default function Cancel() {
   const cancelBooking = async () => {
     if (!booking) return
 
-    const params = new URLSearchParams(window.location.search)
-    const token = params.get('token')
-
     try {
-      const response = await fetch(`https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04?token=${token}`, {
+      const response = await fetch(`https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04?${bookingQuery()}`, {
         method: 'DELETE'
       })
 
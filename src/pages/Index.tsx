@@ -61,36 +61,56 @@ export default function Index() {
     setShowBooking(true)
   }
 
-  const handleConfirmBooking = async () => {
-    try {
-      const response = await fetch('https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          service: selectedService,
-          booking_date: selectedDate?.toISOString().split('T')[0],
-          booking_time: selectedTime,
-          customer_name: customerName,
-          customer_phone: customerPhone
+  // Повторы отправляются с тем же Idempotency-Key, поэтому сервер
+  // вернёт уже созданную запись вместо дубля или ошибки «время занято»
+  const postBooking = async (payload: object, idempotencyKey: string) => {
+    const maxAttempts = 3
+    for (let attempt = 1; ; attempt++) {
+      try {
+        const response = await fetch('https://functions.poehali.dev/44725468-4f39-4361-bc48-b76fb53f5e04', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json', 'Idempotency-Key': idempotencyKey },
+          body: JSON.stringify(payload)
         })
-      })
+        if (response.status < 500 || attempt === maxAttempts) return response
+      } catch (error) {
+        if (attempt === maxAttempts) throw error
+      }
+      await new Promise(resolve => setTimeout(resolve, 500 * attempt))
+    }
+  }
+
+  const handleConfirmBooking = async (): Promise<boolean> => {
+    try {
+      const response = await postBooking({
+        service: selectedService,
+        booking_date: selectedDate?.toISOString().split('T')[0],
+        booking_time: selectedTime,
+        customer_name: customerName,
+        customer_phone: customerPhone
+      }, crypto.randomUUID())
       
       const data = await response.json()
       
       if (response.ok) {
-        alert(`✅ Запись создана!\n\nУслуга: ${selectedService}\nДата: ${selectedDate?.toLocaleDateString('ru-RU')}\nВремя: ${selectedTime}\nИмя: ${customerName}\n\nДля отмены используйте ссылку из SMS`)
+        // Токен отмены сервер отдаёт только в этом ответе и хранит лишь его хэш
+        const cancelInfo = data.cancel_token
+          ? `Ссылка для отмены: ${window.location.origin}/cancel?token=${data.cancel_token}&date=${data.booking_date}`
+          : 'Для отмены используйте ссылку из SMS'
+        alert(`✅ Запись создана!\n\nУслуга: ${selectedService}\nДата: ${selectedDate?.toLocaleDateString('ru-RU')}\nВремя: ${selectedTime}\nИмя: ${customerName}\n\n${cancelInfo}`)
         setShowBooking(false)
         setSelectedService(null)
         setSelectedDate(null)
         setSelectedTime(null)
         setCustomerName('')
         setCustomerPhone('')
-      } else {
-        alert(`Ошибка: ${data.error || 'Не удалось создать запись'}`)
+        return true
       }
+      alert(`Ошибка: ${data.error || 'Не удалось создать запись'}`)
     } catch (error) {
       alert('Ошибка соединения с сервером')
     }
+    return false
   }
 
   return (